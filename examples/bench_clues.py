@@ -0,0 +1,138 @@
+#! /usr/bin/env python
+
+from sat import *
+import random
+
+# times clue translation on scaled up stardust2.py and cubicle.py puzzles
+# against the old lookups, keys.index() and scans of events + pages
+# python bench_clues.py [axes] [tags] [clues]
+# nothing is solved, buffered mode keeps file io out of the numbers
+
+axes = 6
+tags = 15
+clues = 200000
+if len(sys.argv) > 1:
+    axes = int(sys.argv[1])
+if len(sys.argv) > 2:
+    tags = int(sys.argv[2])
+if len(sys.argv) > 3:
+    clues = int(sys.argv[3])
+
+random.seed(1)
+
+class OldZebra(Zebra):
+    "f() as it was, two list scans per call"
+    def f(self, a, b):
+        if self.keys.index(a) > self.keys.index(b):
+            a, b = b, a
+        return self.auto_term(a, b)
+
+class OldSequence(Sequence):
+    "f() as it was, list scans and an auto_term() per tick"
+    def f(self, thing1, mode, thing2):
+        if mode not in ['before', 'during', 'after']:
+            raise Exception('bad mode %s' % mode)
+        if thing1 not in self.events + self.pages:
+            raise Exception('bad thing %s' % thing1)
+        if thing2 not in self.events + self.pages:
+            raise Exception('bad thing %s' % thing2)
+        if thing1 in self.events and thing2 in self.pages:
+            return self.f2(thing1, mode, thing2)
+        if thing1 in self.pages and thing2 in self.events:
+            inv_mode = {'before':'after', 'during':'during', 'after':'before'}
+            return self.f2(thing2, inv_mode[mode], thing1)
+        if thing1 in self.events and thing2 in self.events:
+            return self.f3(thing1, mode, thing2)
+        if thing1 in self.pages and thing2 in self.pages:
+            return self.f4(thing1, mode, thing2)
+    def f2(self, event, mode, page):
+        for t in self.ticks:
+            s1 = self.auto_term(t, event, 'state')
+            t1 = self.auto_term(t, event, 'transition')
+            p1 = self.auto_term(t, page)
+            if mode == 'before':
+                self.write(if_gen(p1, s1, bidirectional=False))
+                self.write(if_gen(-s1, -p1, bidirectional=False))
+                self.write(if_gen(p1, -t1, bidirectional=False))
+                self.write(if_gen(t1, -p1, bidirectional=False))
+            if mode == 'during':
+                self.write(if_gen(p1, t1, bidirectional=True))
+            if mode == 'after':
+                self.write(if_gen(p1, -s1, bidirectional=False))
+                self.write(if_gen(s1, -p1, bidirectional=False))
+                self.write(if_gen(p1, -t1, bidirectional=False))
+                self.write(if_gen(t1, -p1, bidirectional=False))
+    def f3(self, event1, mode, event2):
+        for t in self.ticks:
+            s1 = self.auto_term(t, event1, 'state')
+            s2 = self.auto_term(t, event2, 'state')
+            t1 = self.auto_term(t, event1, 'transition')
+            t2 = self.auto_term(t, event2, 'transition')
+            if mode == 'before':
+                self.write(if_gen(s2, s1, bidirectional=False))
+                self.write(if_gen(-s1, -s2, bidirectional=False))
+                self.write_one(-t1, -t2)
+            if mode == 'during':
+                self.write(if_gen(t1, t2, bidirectional=True))
+            if mode == 'after':
+                self.write(if_gen(s2, -s1, bidirectional=False))
+                self.write(if_gen(s1, -s2, bidirectional=False))
+                self.write(if_gen(s2, -t2, bidirectional=False))
+                self.write(if_gen(t2, -s2, bidirectional=False))
+    def f4(self, page1, mode, page2):
+        for i,t1 in enumerate(self.ticks):
+            for j,t2 in enumerate(self.ticks):
+                if t1 == t2:
+                    continue
+                if mode == 'before' and i < j:
+                    continue
+                if mode == 'after' and i > j:
+                    continue
+                p1 = self.auto_term(t1, page1)
+                p2 = self.auto_term(t2, page2)
+                self.write_one(-p1, -p2)
+
+def timed(fn):
+    start = time.time()
+    fn()
+    return time.time() - start
+
+def compare(label, old, new):
+    print('%-30s %8.3fs %8.3fs %6.1fx' % (label, old, new, old / max(new, 1e-9)))
+
+print('%-30s %9s %9s' % ('', 'old', 'new'))
+
+all_axes = dict(('axis%i' % a, ['tag%i_%i' % (a, t) for t in range(tags)]) for a in range(axes))
+names = sorted(all_axes)
+pairs = []
+for i in range(clues):
+    a1, a2 = random.sample(names, 2)
+    pairs.append((random.choice(all_axes[a1]), random.choice(all_axes[a2])))
+times = {}
+for cls in (OldZebra, Zebra):
+    zebra = cls(buffered=True)
+    load = timed(lambda: zebra.load_axes(all_axes))
+    lookup = timed(lambda: [zebra.f(a, b) for a,b in pairs])
+    times[cls] = (load, lookup)
+    zebra.close()
+compare('zebra load_axes %ix%i' % (axes, tags), times[OldZebra][0], times[Zebra][0])
+compare('zebra f() x%i' % clues, times[OldZebra][1], times[Zebra][1])
+
+events = ['event%i' % i for i in range(tags * 2)]
+pages = ['#%i' % i for i in range(1, tags+1)]
+things = events + pages
+modes = ['before', 'during', 'after']
+calls = []
+while len(calls) < clues // tags:
+    a, b = random.sample(things, 2)
+    mode = random.choice(modes)
+    if a in pages and b in pages and mode == 'during':
+        continue
+    calls.append((a, mode, b))
+times = {}
+for cls in (OldSequence, Sequence):
+    sequence = cls(buffered=True)
+    sequence.load_axes(events, pages)
+    times[cls] = timed(lambda: [sequence.f(*c) for c in calls])
+    sequence.close()
+compare('sequence f() x%i' % len(calls), times[OldSequence], times[Sequence])
@@ -0,0 +1,34 @@
+#! /usr/bin/env python
+
+from sat import *
+
+# count_solutions() against a solutions() loop on latin squares
+# python bench_count.py [size] [loop limit]
+# every square has the same number of true terms
+# so superset blocking in solutions() gives the same count
+
+size = 4
+limit = 5000
+if len(sys.argv) > 1:
+    size = int(sys.argv[1])
+if len(sys.argv) > 2:
+    limit = int(sys.argv[2])
+
+def timed(label, fn):
+    start = time.time()
+    result = fn()
+    print('%-24s %8s %8.3fs' % (label, result, time.time() - start))
+
+cnf = CNF()
+cnf.solver = cnf._run_cdcl
+f = cnf.auto_term
+cells = [[[f(x, y, n) for n in range(size)] for y in range(size)] for x in range(size)]
+for x,y in product(range(size), repeat=2):
+    cnf.write(window(cells[x][y], 1, 1))
+    cnf.write(window([cells[x][i][y] for i in range(size)], 1, 1))
+    cnf.write(window([cells[i][x][y] for i in range(size)], 1, 1))
+
+timed('count_solutions()', cnf.count_solutions)
+loop = lambda: len(list(cnf.solutions(limit)))
+timed('solutions(%i) loop' % limit, loop)
+cnf.close()
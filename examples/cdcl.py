@@ -0,0 +1 @@
+../python/cdcl.py
\ No newline at end of file
@@ -0,0 +1 @@
+../python/dimacs.py
\ No newline at end of file
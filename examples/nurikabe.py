@@ -3,10 +3,10 @@
 from sat import *
 
 """
-many many flood fills!
-a limited flood for each number
-one big flood for stream
-optimization: exact floods don't cover the whole board
+one partition of the board
+a limited region for each number
+one big region for stream
+optimization: numbered regions don't cover the whole board
 """
 
 puzzle = """\
@@ -33,7 +33,6 @@ def clean(puz):
 table = clean(puzzle)
 y_dim = len(puzzle.split('\n'))
 x_dim = len(puzzle.split('\n')[0].strip())
-z_dim = int(x_dim * y_dim / 2)
 xs = range(x_dim)
 ys = range(y_dim)
 
@@ -55,33 +54,6 @@ for x,y in product(xs[:-1], ys[:-1]):
 
 adj = cartesian_table(xs, ys)
 
-cnf.comment('walls')
-wall_labels = []
-wall_summaries = set()
-for x,y in table:
-    label = 'wall %i %i' % (x,y)
-    wall_labels.append(label)
-    size = table[(x,y)]
-    cnf.comment(label)
-    mapping = floodfill(cnf, label, adj, size, exact=True, seed=(x,y))
-    wall_summaries.update(mapping.values())
-    cnf.comment('link ' + label)
-    for x2,y2 in mapping:
-        cnf.write(if_then(f(*mapping[(x2,y2)]), -f('base', x2, y2)))
-
-cnf.comment("walls can't touch")
-# little tricky to explain
-# forbid summary + !summary neighbor + !base neighbor
-for x,y in table:
-    label = 'wall %i %i' % (x,y)
-    cnf.comment('dont touch ' + label)
-    for x2,y2 in product(xs,ys):
-        for x3,y3 in neighbors(x2,y2,xs,ys):
-            cell1 = f(label, 'summary', (x2,y2))
-            cell2 = f(label, 'summary', (x3,y3))
-            cell3 = f('base', x3, y3)
-            cnf.write_one(-cell1, cell2, cell3)
-
 cnf.comment("stream")
 # use a seed for faster fill
 seed = None
@@ -89,16 +61,21 @@ for x,y in table:
     if table[(x,y)] == 1:
         seed = neighbors(x,y,xs,ys)[0]
         break
-mapping = floodfill(cnf, 'stream', adj, z_dim, seed=seed)
+
+# one partition instead of a flood fill per wall
+# walls can't touch each other, every cell is a wall or the stream
+regions = {'stream': (seed, None)}
+wall_labels = []
+for x,y in table:
+    label = 'wall %i %i' % (x,y)
+    wall_labels.append(label)
+    regions[label] = ((x,y), table[(x,y)])
+maps = partition(cnf, 'regions', adj, regions, apart=wall_labels)
 
 cnf.comment("stream summary")
+mapping = maps['stream']
 for x,y in mapping:
-    cnf.write(if_then(f(*mapping[(x,y)]), f('base', x, y)))
-
-cnf.comment('no overlap between regions')
-for x,y in product(xs,ys):
-    cells = [f(label, 'summary', (x,y)) for label in wall_labels + ['stream']]
-    cnf.write(window(cells, 1, 1))
+    cnf.write(if_gen(f(*mapping[(x,y)]), f('base', x, y), bidirectional=True))
 
 print('terms:', cnf.maxterm)
 print('clauses:', cnf.clauses)
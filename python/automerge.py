@@ -1,14 +1,19 @@
 #! /usr/bin/env python
 
 import os, sys
+from array import array
+import dimacs
+from sat import dimacs_header, patch_header
 
 # GPLv3
 
 # lut file is tab separated key:value list
 # (value could be inferred from order, but why chance it)
 # could be more paranoid, assumes input luts are well formed
+# terms without a lut entry are private to their input
 
-# todo: preserve comments across merges
+# each input is streamed through in big slices
+# literals are remapped with one table lookup each, no per-term python math
 
 if len(sys.argv) < 4:
     print('automerge.py output in1 in2 ...')
@@ -26,46 +31,78 @@ if os.path.isfile(out_lut):
     sys.exit(1)
 
 def load_lut(path):
+    "term: key, plus the comments"
     lut = {}
+    comments = []
     for line in open(path):
-        line = line.strip()
+        line = line.rstrip('\n')
         if line.startswith('#'):
+            comments.append(line)
             continue
-        k,v = line.split('\t')
-        lut[k] = v
-    return lut
+        k,v = line.rsplit('\t', 1)
+        lut[int(v)] = k
+    return lut, comments
 
-def sorted_keys(lut):
-    return [vk[1] for vk in sorted((v,k) for k,v in in_lut.items())]
+class Merge(object):
+    "shared key: term table for every input"
+    def __init__(self):
+        self.lut = {}
+        self.maxterm = 0
+        self.clauses = 0
+    def new_term(self):
+        self.maxterm += 1
+        return self.maxterm
+    def table(self, in_lut, terms, table=None):
+        "list indexed by old literal, negatives wrap around from the end"
+        # table[n] is the new term, table[-n] is the negated new term
+        old = []
+        if table is not None:
+            old = table[:len(table)//2 + 1]
+        table = [0] * (2 * terms + 1)
+        for n in range(1, terms + 1):
+            if n < len(old):
+                new = old[n]
+            elif n in in_lut:
+                key = in_lut[n]
+                if key not in self.lut:
+                    self.lut[key] = self.new_term()
+                new = self.lut[key]
+            else:
+                new = self.new_term()
+            table[n] = new
+            table[-n] = -new
+        return table
+    def merge(self, fh, name):
+        in_lut, lut_comments = load_lut(name + '.lut')
+        fh.write('c automerge %s\n' % name)
+        table = None
+        labelled = max([0] + list(in_lut))
+        for piece in dimacs.pieces(name + '.cnf'):
+            lits = piece.lits
+            terms = max(piece.terms, piece.maxterm(), labelled)
+            if table is None or terms > len(table) // 2:
+                table = self.table(in_lut, terms, table)
+            lits = array('i', map(table.__getitem__, lits))
+            self.clauses += lits.count(0)
+            for comment, start, end in piece.sections(None):
+                if comment:
+                    fh.write('c %s\n' % comment)
+                dimacs.write_range(fh, lits, start, end)
+        return lut_comments
 
 new_cnf = open(out_cnf, 'w')
-tmp_lut = {}
-
+new_cnf.write(dimacs_header(0, 0))
+merge = Merge()
+lut_comments = []
 for in_name in sys.argv[2:]:
-    # load lut
-    in_lut = load_lut(in_name + '.lut')
-    translate = {}
-    for k in sorted_keys(in_lut):
-        if k not in new_lut:
-            tmp_lut[k] = len(tmp_lut) + 1
-        translate[in_lut[k]] = tmp_lut[k]
-    # update cnf
-    new_cnf.write('c automerge %s\n' % in_name)
-    for line in open(in_name + '.cnf'):
-        if line.startswith('c'):
-            new_cnf.write(line)
-            continue
-        clause = map(int, line.strip().split())
-        new_clause = []
-        for term in clause:
-            sign = term / abs(term)
-            new_clause.append(sign * translate[abs(term)])
-        new_cnf.write(' '.join(map(str, new_clause)) + ' 0\n')
+    lut_comments.append('# automerge %s' % in_name)
+    lut_comments.extend(merge.merge(new_cnf, in_name))
 new_cnf.close()
+patch_header(out_cnf, merge.maxterm, merge.clauses)
 
 new_lut = open(out_lut, 'w')
-for k in sorted_keys(tmp_lut):
-    new_lut.write('%i\t%i\n' % (k, tmp_lut[k]))
+for line in lut_comments:
+    new_lut.write(line + '\n')
+for k,v in sorted(merge.lut.items(), key=lambda kv: kv[1]):
+    new_lut.write('%s\t%i\n' % (k, v))
 new_lut.close()
-
-
@@ -0,0 +1,520 @@
+#! /usr/bin/env python
+
+# works in python 2 or 3
+# GPLv3
+
+"""
+small conflict driven clause learning solver
+not competitive with minisat, but it lives in-process
+so the formula is parsed once and clauses can be added between solves
+(ipasir style: add_clause/solve/val/failed)
+
+command line use mimics minisat: cdcl.py in.cnf [out.txt], exit 10/20
+"""
+
+import sys
+from heapq import heappush, heappop, heapify
+
+def luby(i):
+    "1 1 2 1 1 2 4 1 1 2 ..."
+    size, seq = 1, 0
+    while size < i + 1:
+        seq += 1
+        size = 2 * size + 1
+    while size - 1 != i:
+        size = (size - 1) >> 1
+        seq -= 1
+        i = i % size
+    return 2 ** seq
+
+class Solver(object):
+    # literals are coded as 2*var + sign
+    # lit_values[code] is 1 for true, -1 for false, 0 for unassigned
+    def __init__(self):
+        self.nvars = 0
+        self.ok = True
+        self.clauses = []
+        self.learnts = []
+        self.lbd = {}
+        self.watches = [[], []]
+        self.lit_values = [0, 0]
+        self.level = [0]
+        self.reason = [None]
+        self.activity = [0.0]
+        self.polarity = [1]
+        self.seen = [False]
+        self.trail = []
+        self.trail_lim = []
+        # one flag per level, True when count() flipped its decision
+        self.flipped = []
+        self.qhead = 0
+        self.heap = []
+        self.var_inc = 1.0
+        self.max_learnts = 2000
+        self.model = []
+        self.core = set()
+        self.conflicts = 0
+        self.decisions = 0
+        self.propagations = 0
+        self.restart_base = 100
+        # count() decides these first, so every model ends in a flip
+        self.project = [False]
+        self.project_heap = []
+        self.models = 0
+    def _grow(self, v):
+        "make room for variables up to v"
+        while self.nvars < v:
+            self.nvars += 1
+            self.watches.extend(([], []))
+            self.lit_values.extend((0, 0))
+            self.level.append(0)
+            self.reason.append(None)
+            self.activity.append(0.0)
+            self.polarity.append(1)
+            self.seen.append(False)
+            self.project.append(False)
+            heappush(self.heap, (0.0, self.nvars))
+    def add_clause(self, clause):
+        "only call between solves"
+        if not self.ok:
+            return False
+        self._cancel(0)
+        lits = set()
+        for n in clause:
+            if n == 0:
+                raise Exception("Illegal term, 0")
+            v = abs(n)
+            if v > self.nvars:
+                self._grow(v)
+            lits.add(2*v + (n < 0))
+        c = []
+        values = self.lit_values
+        for l in lits:
+            if l ^ 1 in lits or values[l] == 1:
+                # tautology or already satisfied at level 0
+                return True
+            if values[l] == 0:
+                c.append(l)
+        if not c:
+            self.ok = False
+            return False
+        if len(c) == 1:
+            self._enqueue(c[0], None)
+            if self._propagate() is not None:
+                self.ok = False
+            return self.ok
+        self._attach(c)
+        self.clauses.append(c)
+        return True
+    def add_clauses(self, clauses):
+        for clause in clauses:
+            self.add_clause(clause)
+        return self.ok
+    def _attach(self, c):
+        self.watches[c[0]].append(c)
+        self.watches[c[1]].append(c)
+    def _detach(self, c):
+        self.watches[c[0]].remove(c)
+        self.watches[c[1]].remove(c)
+    def _enqueue(self, l, why):
+        v = l >> 1
+        self.lit_values[l] = 1
+        self.lit_values[l ^ 1] = -1
+        self.level[v] = len(self.trail_lim)
+        self.reason[v] = why
+        self.trail.append(l)
+    def _propagate(self):
+        "returns a conflicting clause or None"
+        values = self.lit_values
+        watches = self.watches
+        trail = self.trail
+        level = self.level
+        reason = self.reason
+        dl = len(self.trail_lim)
+        qhead = self.qhead
+        while qhead < len(trail):
+            false_lit = trail[qhead] ^ 1
+            qhead += 1
+            ws = watches[false_lit]
+            i = j = 0
+            n = len(ws)
+            while i < n:
+                c = ws[i]
+                i += 1
+                if c[0] == false_lit:
+                    c[0] = c[1]
+                    c[1] = false_lit
+                first = c[0]
+                if values[first] == 1:
+                    ws[j] = c
+                    j += 1
+                    continue
+                for k in range(2, len(c)):
+                    l = c[k]
+                    if values[l] != -1:
+                        c[1] = l
+                        c[k] = false_lit
+                        watches[l].append(c)
+                        break
+                else:
+                    ws[j] = c
+                    j += 1
+                    if values[first] == -1:
+                        while i < n:
+                            ws[j] = ws[i]
+                            j += 1
+                            i += 1
+                        del ws[j:]
+                        self.propagations += qhead - self.qhead
+                        self.qhead = len(trail)
+                        return c
+                    # unit, inlined _enqueue
+                    values[first] = 1
+                    values[first ^ 1] = -1
+                    v = first >> 1
+                    level[v] = dl
+                    reason[v] = c
+                    trail.append(first)
+            del ws[j:]
+        self.propagations += qhead - self.qhead
+        self.qhead = qhead
+        return None
+    def _cancel(self, lvl):
+        if len(self.trail_lim) <= lvl:
+            return
+        values = self.lit_values
+        polarity = self.polarity
+        activity = self.activity
+        heap = self.heap
+        start = self.trail_lim[lvl]
+        for l in self.trail[start:]:
+            v = l >> 1
+            values[l] = 0
+            values[l ^ 1] = 0
+            self.reason[v] = None
+            polarity[v] = l & 1
+            heappush(heap, (-activity[v], v))
+            if self.project[v]:
+                heappush(self.project_heap, (-activity[v], v))
+        del self.trail[start:]
+        del self.trail_lim[lvl:]
+        del self.flipped[lvl:]
+        self.qhead = start
+    def _bump(self, v):
+        act = self.activity[v] + self.var_inc
+        self.activity[v] = act
+        if act > 1e100:
+            self.activity = [a * 1e-100 for a in self.activity]
+            self.var_inc *= 1e-100
+            self._rebuild_heap()
+        elif self.lit_values[2*v] == 0:
+            heappush(self.heap, (-act, v))
+            if self.project[v]:
+                heappush(self.project_heap, (-act, v))
+    def _rebuild_heap(self):
+        values = self.lit_values
+        self.heap = [(-a, v) for v,a in enumerate(self.activity) if v and values[2*v] == 0]
+        heapify(self.heap)
+        self.project_heap = [(a, v) for a,v in self.heap if self.project[v]]
+        heapify(self.project_heap)
+    def _analyze(self, confl):
+        "first uip learning, returns (learnt clause, backtrack level)"
+        seen = self.seen
+        level = self.level
+        reason = self.reason
+        trail = self.trail
+        dl = len(self.trail_lim)
+        learnt = [0]
+        path = 0
+        p = None
+        index = len(trail) - 1
+        while True:
+            for q in (confl if p is None else confl[1:]):
+                v = q >> 1
+                if not seen[v] and level[v] > 0:
+                    self._bump(v)
+                    seen[v] = True
+                    if level[v] >= dl:
+                        path += 1
+                    else:
+                        learnt.append(q)
+            while not seen[trail[index] >> 1]:
+                index -= 1
+            p = trail[index]
+            index -= 1
+            confl = reason[p >> 1]
+            seen[p >> 1] = False
+            path -= 1
+            if path == 0:
+                break
+        learnt[0] = p ^ 1
+        # cheap minimization, drop literals implied by the rest
+        keep = [learnt[0]]
+        for q in learnt[1:]:
+            r = reason[q >> 1]
+            if r is None or not all(seen[x >> 1] or level[x >> 1] == 0 for x in r[1:]):
+                keep.append(q)
+        for q in learnt[1:]:
+            seen[q >> 1] = False
+        learnt = keep
+        if len(learnt) == 1:
+            return learnt, 0
+        best = 1
+        for i in range(2, len(learnt)):
+            if level[learnt[i] >> 1] > level[learnt[best] >> 1]:
+                best = i
+        learnt[1], learnt[best] = learnt[best], learnt[1]
+        return learnt, level[learnt[1] >> 1]
+    def _analyze_final(self, p):
+        "which assumptions forced p false"
+        core = set([p])
+        if not self.trail_lim:
+            return core
+        seen = self.seen
+        seen[p >> 1] = True
+        for l in reversed(self.trail[self.trail_lim[0]:]):
+            v = l >> 1
+            if not seen[v]:
+                continue
+            r = self.reason[v]
+            if r is None:
+                core.add(l)
+            else:
+                for q in r[1:]:
+                    if self.level[q >> 1] > 0:
+                        seen[q >> 1] = True
+            seen[v] = False
+        seen[p >> 1] = False
+        return core
+    def _reduce(self):
+        "forget the less useful half of the learnt clauses"
+        lbd = self.lbd
+        reason = self.reason
+        self.learnts.sort(key=lambda c: (lbd[id(c)], len(c)))
+        half = len(self.learnts) // 2
+        keep = self.learnts[:half]
+        for c in self.learnts[half:]:
+            if lbd[id(c)] <= 2 or reason[c[0] >> 1] is c:
+                keep.append(c)
+                continue
+            self._detach(c)
+            del lbd[id(c)]
+        self.learnts = keep
+    def _decide(self):
+        values = self.lit_values
+        activity = self.activity
+        heap = self.project_heap
+        while heap:
+            a,v = heappop(heap)
+            if values[2*v] == 0 and -a == activity[v]:
+                return 2*v + self.polarity[v]
+        heap = self.heap
+        while heap:
+            a,v = heappop(heap)
+            if values[2*v] == 0 and -a == activity[v]:
+                return 2*v + self.polarity[v]
+        # stale heap entries may have hidden something
+        for v in range(1, self.nvars+1):
+            if values[2*v] == 0:
+                return 2*v + self.polarity[v]
+        return None
+    def _next_branch(self, k):
+        "flip the deepest open decision below level k, False when none are left"
+        # flipped levels already had their other branch counted
+        while k and self.flipped[k-1]:
+            k -= 1
+        if k == 0:
+            return False
+        l = self.trail[self.trail_lim[k-1]]
+        self._cancel(k - 1)
+        self.trail_lim.append(len(self.trail))
+        self.flipped.append(True)
+        self._enqueue(l ^ 1, None)
+        return True
+    def _block_model(self):
+        "count the model and move on to the next branch, False when done"
+        self.models += 1
+        # projected decisions come first, their levels fix every projected term
+        trail = self.trail
+        lim = self.trail_lim
+        k = 0
+        while k < len(lim) and self.project[trail[lim[k]] >> 1]:
+            k += 1
+        return self._next_branch(k)
+    def _search(self, budget, assumptions, counting=False):
+        "True, False or None for a restart"
+        conflicts = 0
+        while True:
+            confl = self._propagate()
+            if confl is not None:
+                self.conflicts += 1
+                conflicts += 1
+                if not self.trail_lim:
+                    self.ok = False
+                    return False
+                if counting and self.flipped[-1]:
+                    # both branches of the level below are finished
+                    if not self._next_branch(len(self.trail_lim) - 1):
+                        self._cancel(0)
+                        return False
+                    continue
+                learnt, back = self._analyze(confl)
+                if counting and True in self.flipped:
+                    # backjumps stop at the last flip, the learnt literal
+                    # is implied up there as well
+                    back = max(back, len(self.flipped) - self.flipped[::-1].index(True))
+                self._cancel(back)
+                if len(learnt) == 1 and back:
+                    self._enqueue(learnt[0], learnt)
+                elif len(learnt) == 1:
+                    self._enqueue(learnt[0], None)
+                else:
+                    self._attach(learnt)
+                    self.learnts.append(learnt)
+                    self.lbd[id(learnt)] = len(set(self.level[l >> 1] for l in learnt))
+                    self._enqueue(learnt[0], learnt)
+                self.var_inc /= 0.95
+                continue
+            if conflicts >= budget:
+                self._cancel(0)
+                return None
+            if len(self.learnts) - len(self.trail) >= self.max_learnts:
+                self._reduce()
+                self.max_learnts = int(self.max_learnts * 1.1)
+            next_lit = None
+            while len(self.trail_lim) < len(assumptions):
+                p = assumptions[len(self.trail_lim)]
+                if self.lit_values[p] == 1:
+                    self.trail_lim.append(len(self.trail))
+                    self.flipped.append(False)
+                elif self.lit_values[p] == -1:
+                    self.core = self._analyze_final(p)
+                    return False
+                else:
+                    next_lit = p
+                    break
+            if next_lit is None:
+                next_lit = self._decide()
+                if next_lit is None and counting:
+                    if not self._block_model():
+                        self._cancel(0)
+                        return False
+                    continue
+                if next_lit is None:
+                    values = self.lit_values
+                    self.model = [False] + [values[2*v] == 1 for v in range(1, self.nvars+1)]
+                    return True
+                self.decisions += 1
+            self.trail_lim.append(len(self.trail))
+            self.flipped.append(False)
+            self._enqueue(next_lit, None)
+    def solve(self, assumptions=()):
+        "assumptions are literals that hold for this call only"
+        self.core = set()
+        self.model = []
+        if not self.ok:
+            return False
+        self._cancel(0)
+        codes = []
+        for n in assumptions:
+            v = abs(n)
+            if v > self.nvars:
+                self._grow(v)
+            codes.append(2*v + (n < 0))
+        if self._propagate() is not None:
+            self.ok = False
+            return False
+        self.max_learnts = max(self.max_learnts, len(self.clauses) // 3)
+        status = None
+        restarts = 0
+        while status is None:
+            status = self._search(self.restart_base * luby(restarts), codes)
+            restarts += 1
+        self._cancel(0)
+        # report the core in the caller's terms
+        self.core = set(l >> 1 if l & 1 == 0 else -(l >> 1) for l in self.core)
+        self.core = set(n for n in assumptions if n in self.core)
+        return status
+    def count(self, projection):
+        "number of distinct models over the projection, the solver is spent afterwards"
+        # one pass of the search, after each model the deepest unflipped
+        # projected decision is flipped, like dpll, so nothing is counted twice
+        self.models = 0
+        if not self.ok:
+            return 0
+        self._cancel(0)
+        for v in projection:
+            if v > self.nvars:
+                self._grow(v)
+            self.project[v] = True
+        self._rebuild_heap()
+        if self._propagate() is not None:
+            self.ok = False
+            return 0
+        # no restarts, they would throw away the flipped branches
+        self._search(float('inf'), [], counting=True)
+        self.ok = False
+        return self.models
+    def val(self, n):
+        "value of a literal in the last model"
+        v = abs(n)
+        if v >= len(self.model):
+            return None
+        return self.model[v] == (n > 0)
+    def failed(self, n):
+        "was this assumption part of the last unsat answer"
+        return n in self.core
+    def solution(self):
+        "true terms of the last model, like the CNF.solver backends"
+        return set(v for v in range(1, len(self.model)) if self.model[v])
+
+def count_projected(clauses, projection):
+    "number of distinct models restricted to the projection variables"
+    # projection variables that never show up are free, the rest are counted
+    projection = set(abs(v) for v in projection)
+    solver = Solver()
+    used = set()
+    for clause in clauses:
+        used.update(abs(n) for n in clause)
+        solver.add_clause(clause)
+    free = len(projection - used)
+    return solver.count(projection & used) * 2 ** free
+
+def parse_dimacs(data):
+    "bytes or str of dimacs, yields int clauses"
+    clause = []
+    for line in data.splitlines():
+        line = line.strip()
+        if not line or line[:1] in (b'c', b'p', 'c', 'p'):
+            continue
+        for n in map(int, line.split()):
+            if n == 0:
+                yield clause
+                clause = []
+            else:
+                clause.append(n)
+
+def main():
+    if len(sys.argv) not in (2, 3):
+        print('cdcl.py input.cnf [output.txt]')
+        sys.exit(1)
+    solver = Solver()
+    data = open(sys.argv[1], 'rb').read()
+    solver.add_clauses(parse_dimacs(data))
+    status = solver.solve()
+    out = None
+    if len(sys.argv) == 3:
+        out = open(sys.argv[2], 'w')
+    if status:
+        model = ' '.join(str(v if solver.model[v] else -v) for v in range(1, solver.nvars+1))
+        print('s SATISFIABLE')
+        if out:
+            out.write('SAT\n%s 0\n' % model)
+    else:
+        print('s UNSATISFIABLE')
+        if out:
+            out.write('UNSAT\n')
+    sys.exit((20, 10)[status])
+
+if __name__ == '__main__':
+    main()
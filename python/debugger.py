@@ -1,6 +1,8 @@
 #! /usr/bin/env python
 
-import sys, subprocess
+import os, sys
+import multiprocessing
+import dimacs, cdcl
 from collections import defaultdict
 from itertools import *
 
@@ -8,88 +10,285 @@ from itertools import *
 GPLv3
 given a bad CNF
 chop into comment:clause sets
-disable permutes of clauses
+every set gets a selector term, so the cnf is loaded once
+and each trial is a solve under assumptions
+finds a minimal conflict (MUS) with quickxplain
+and the minimal sets of rules to delete (MCS) by size
+trials are spread over a process pool, one solver per worker
+results flow back to the main process and out to the workers again
 add solution counts?
 """
 
-if len(sys.argv) == 1 or len(sys.argv) > 3:
+def usage():
     print("debugger.py - find what blocks a good SAT")
-    print("use: debugger.py [errors] filename.cnf")
+    print("use: debugger.py [-jN] [errors] filename.cnf")
     print("    [errors] is optional, default is 1")
     print("    'all' is legal but takes some time")
+    print("    -jN runs N workers, default is one per core")
     print("    requires a well commented CNF file")
     sys.exit()
 
-path  = sys.argv[-1]
-path2 = '/tmp/debugger.tmp.cnf'
-if len(sys.argv) == 3 and sys.argv[1] == 'all':
-    limit = 'all'
-elif len(sys.argv) == 3:
-    limit = int(sys.argv[1])
-else:
-    limit = 1
-
-def valid(cnf_path):
-    pipe = subprocess.PIPE
-    status = subprocess.call(['minisat', cnf_path], stdout=pipe, stderr=pipe)
-    if status == 10:
-        return True
-    if status == 20:
+class Rules(object):
+    "comment groups of a cnf behind selector terms"
+    def __init__(self, loaded):
+        self.names = []
+        self.solver = cdcl.Solver()
+        self.calls = 0
+        self.worker_calls = 0  # summed from the pool
+        # a subset of sat is sat, a superset of unsat is unsat
+        self.known = {}  # rule set: True or its unsat core
+        self.sat_sets = defaultdict(list)  # rule: sat sets with it
+        self.unsat_sets = defaultdict(list)  # lowest rule: unsat cores
+        self.any_sat = False
+        self.cores = set()
+        self.facts = []  # (rule set, result) in order, for sharing
+        self.last_core = frozenset()
+        ranges = defaultdict(list)
+        for comment, start, end in loaded.sections():
+            if start == end:
+                continue
+            if comment not in ranges:
+                # easier to read when order matches the source
+                self.names.append(comment)
+            ranges[comment].append((start, end))
+        base = loaded.maxterm()
+        self.selector = dict((i, base + i + 1) for i in range(len(self.names)))
+        for i,comment in enumerate(self.names):
+            off = -self.selector[i]
+            for start, end in ranges[comment]:
+                for clause in loaded.clause_range(start, end):
+                    self.solver.add_clause(clause + (off,))
+    def learn(self, rules, result):
+        "remember a trial, result is True or the unsat core"
+        if rules in self.known:
+            return
+        self.facts.append((rules, result))
+        if result is True:
+            self.known[rules] = result
+            self.any_sat = True
+            for i in rules:
+                self.sat_sets[i].append(rules)
+            return
+        self.known[rules] = result
+        if result not in self.cores:
+            self.cores.add(result)
+            self.known[result] = result
+            self.unsat_sets[min(result) if result else None].append(result)
+    def merge(self, facts):
+        "trials from another process"
+        for rules, result in facts:
+            self.learn(rules, result)
+    def lookup(self, rules):
+        "True, a core or None when the cache can't tell"
+        if rules in self.known:
+            return self.known[rules]
+        # a core is only a candidate if its lowest rule is in the trial
+        for i in chain([None], rules):
+            for core in self.unsat_sets.get(i, []):
+                if core <= rules:
+                    return core
+        if not rules:
+            return self.any_sat or None
+        # any sat superset has to contain the lowest rule too
+        if any(rules <= known for known in self.sat_sets.get(min(rules), [])):
+            return True
+        return None
+    def valid(self, rules):
+        "satisfiable with only these rules"
+        rules = frozenset(rules)
+        result = self.lookup(rules)
+        if result is None:
+            self.calls += 1
+            if self.solver.solve([self.selector[i] for i in rules]):
+                result = True
+            else:
+                # the failed assumptions rule out more supersets than the trial
+                result = frozenset(i for i in rules if self.solver.failed(self.selector[i]))
+            self.learn(rules, result)
+        if result is True:
+            return True
+        self.last_core = result
         return False
-    raise Exception("unknown minisat return")
-
-def all_combinations(thing):
-    for i in range(1, len(thing)+1):
-        for cs in combinations(thing, i):
-            yield set(cs)
-
-def trivial_superset(test_set, many_sets):
-    "many_sets must be a list of sets"
-    # shame you can't have a set of sets
-    # 'all' filters pure supersets, but 'any' catches trivial ones
-    return any(subset in many_sets for subset in all_combinations(test_set))
-
-if valid(path):
-    print('No bugs in CNF.')
-    sys.exit(0)
-
-clauses = defaultdict(list)
-ordered_comments = []
-comment = 'beginning of file'
-ordered_comments.append([comment])
-for line in open(path):
-    if line.startswith('c'):
-        comment = line[1:].strip()
-        ordered_comments.append([comment])
-        continue
-    clauses[comment].append(line)
-if limit == 'all':
-    limit = len(clauses)
-
-error_sets = []
-print('rules:', sum(bool(len(v)) for v in clauses.values()),'\n')
-for i in range(1, limit+1):
-    if limit > 1:
-        print('combination size', i, '\n')
-    if i == 1:
-        # easier to read when order matches the source
-        trials = ordered_comments
+    def core(self, rules):
+        "the rules used by the last failed trial"
+        return [i for i in rules if i in self.last_core]
+    def quickxplain(self, background, candidates, delta=False):
+        "smallest part of candidates that conflicts with background"
+        if delta and not self.valid(background):
+            return []
+        if len(candidates) == 1:
+            return candidates
+        half = len(candidates) // 2
+        c1, c2 = candidates[:half], candidates[half:]
+        d2 = self.quickxplain(background + c1, c2, True)
+        d1 = self.quickxplain(background + d2, c1, bool(d2))
+        return d1 + d2
+    def mus(self, rules):
+        "minimal unsatisfiable subset, rules must be unsat"
+        # valid() also sets last_core, so it can't live in an assert
+        if self.valid(rules):
+            raise Exception("No conflict, these rules are satisfiable")
+        # the failed assumptions are a free first cut
+        return sorted(self.quickxplain([], self.core(rules)))
+    def mcs(self, rules, removed):
+        "shrink a set of removed rules that fixes the cnf"
+        removed = list(removed)
+        for i in list(removed):
+            trial = [r for r in removed if r != i]
+            if self.valid([r for r in rules if r not in trial]):
+                removed = trial
+        return sorted(removed)
+
+def trial(rules, removed):
+    "either an MCS inside removed or a MUS outside of it"
+    everything = list(range(len(rules.names)))
+    rest = [i for i in everything if i not in removed]
+    if rules.valid(rest):
+        return 'mcs', rules.mcs(everything, removed)
+    return 'mus', rules.mus(rest)
+
+# each pool worker loads its own solver and keeps its own cache
+# tasks carry the main process's facts, results carry the worker's back
+worker_rules = None
+worker_synced = 0  # main process facts merged so far
+
+def worker_init(path):
+    global worker_rules
+    worker_rules = Rules(dimacs.load(path))
+
+def worker_trial(task):
+    global worker_synced
+    removed, offset, facts = task
+    skip = max(0, worker_synced - offset)
+    worker_rules.merge(facts[skip:])
+    worker_synced = max(worker_synced, offset + len(facts))
+    start = len(worker_rules.facts)
+    calls = worker_rules.calls
+    kind, rule_set = trial(worker_rules, removed)
+    # merged facts sit in worker_rules.facts too, only send the new ones
+    learned = worker_rules.facts[start:]
+    return kind, rule_set, learned, worker_rules.calls - calls, os.getpid(), worker_synced
+
+def at_most(solver, cells, new):
+    "sequential counter, returns outputs[j] meaning more than j are true"
+    outputs = []
+    for n, cell in enumerate(cells):
+        row = [new() for j in range(n + 1)]
+        solver.add_clause((-cell, row[0]))
+        for j, out in enumerate(outputs):
+            solver.add_clause((-out, row[j]))
+            solver.add_clause((-out, -cell, row[j+1]))
+        outputs = row
+    return outputs
+
+def pool_trials(rules, pool, batch, synced, jobs):
+    "run a batch on the pool, merge what the workers learned"
+    # send the facts every worker may still be missing
+    offset = 0
+    if len(synced) >= jobs:
+        offset = min(synced.values())
+    tasks = [(removed, offset, rules.facts[offset:]) for removed in batch]
+    results = []
+    for kind, rule_set, learned, calls, pid, done in pool.map(worker_trial, tasks):
+        rules.merge(learned)
+        rules.worker_calls += calls
+        synced[pid] = done
+        results.append((kind, rule_set))
+    return results
+
+def corrections(rules, limit, conflicts, pool=None, width=1, jobs=1):
+    "minimal sets of rules to delete, smallest first, via a map of trials"
+    synced = {}  # worker pid: facts it has merged
+    everything = list(range(len(rules.names)))
+    removal = cdcl.Solver()
+    terms = count(len(everything) + 1)
+    new = lambda: next(terms)
+    cells = [i + 1 for i in everything]
+    outputs = at_most(removal, cells, new)
+    # conflicts found beforehand don't need a trial to rediscover them
+    for rule_set in conflicts:
+        removal.add_clause([i + 1 for i in rule_set])
+    for size in range(1, limit + 1):
+        found = set()
+        # removing more than size rules is off the table
+        bound = [-outputs[size]] if size < len(outputs) else []
+        while True:
+            batch = []
+            while len(batch) < width and removal.solve(bound):
+                removed = [i for i in everything if removal.val(i + 1)]
+                batch.append(removed)
+                # the trial result will block more than this
+                removal.add_clause([-c if removal.val(c) else c for c in cells])
+            if not batch:
+                break
+            if pool is None:
+                results = [trial(rules, removed) for removed in batch]
+            else:
+                results = pool_trials(rules, pool, batch, synced, jobs)
+            for kind, rule_set in results:
+                if kind == 'mcs':
+                    found.add(tuple(rule_set))
+                    # no supersets
+                    removal.add_clause([-(i + 1) for i in rule_set])
+                    continue
+                if rule_set not in conflicts:
+                    conflicts.append(rule_set)
+                # at least one of these has to go
+                removal.add_clause([i + 1 for i in rule_set])
+        yield size, sorted(found)
+
+def main():
+    args = sys.argv[1:]
+    jobs = multiprocessing.cpu_count()
+    for arg in list(args):
+        if arg.startswith('-j'):
+            jobs = int(arg[2:])
+            args.remove(arg)
+    if len(args) not in (1, 2):
+        usage()
+    path = args[-1]
+    if len(args) == 2 and args[0] == 'all':
+        limit = 'all'
+    elif len(args) == 2:
+        limit = int(args[0])
     else:
-        trials = combinations(clauses, i)
-    for skip in trials:
-        skip = set(skip)
-        if trivial_superset(skip, error_sets):
-            continue
-        fh = open(path2, 'w')
-        for comment in clauses:
-            if comment in skip:
-                continue
-            fh.write('c ' + comment + '\n')
-            fh.writelines(clauses[comment])
-        fh.close()
-        if not valid(path2):
-            continue
-        print('\n'.join(skip), '\n')
-        error_sets.append(skip)
+        limit = 1
+
+    rules = Rules(dimacs.load(path))
+    everything = list(range(len(rules.names)))
+
+    if rules.valid(everything):
+        print('No bugs in CNF.')
+        sys.exit(0)
+
+    if limit == 'all':
+        limit = len(rules.names)
+
+    pool = None
+    if jobs > 1:
+        pool = multiprocessing.Pool(jobs, worker_init, (path,))
+
+    print('rules:', len(rules.names),'\n')
+    conflicts = [rules.mus(everything)]
+    print('minimal conflict\n')
+    print('\n'.join(rules.names[i] for i in conflicts[0]), '\n')
     print('\n')
+    for size, found in corrections(rules, limit, conflicts, pool, jobs * 2, jobs):
+        if limit > 1:
+            print('combination size', size, '\n')
+        for fix in found:
+            print('\n'.join(rules.names[i] for i in fix), '\n')
+        print('\n')
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if len(conflicts) > 1:
+        print('other minimal conflicts\n')
+    for conflict in conflicts[1:]:
+        print('\n'.join(rules.names[i] for i in conflict), '\n')
+    if len(conflicts) > 1:
+        print('\n')
+    print('solver calls:', rules.calls + rules.worker_calls)
 
+if __name__ == '__main__':
+    main()
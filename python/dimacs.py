@@ -0,0 +1,199 @@
+#! /usr/bin/env python
+
+# GPLv3
+
+# bulk dimacs loading, shared by sat.py, simplify.py and debugger.py
+# the clause body between two comment lines is split and converted in one go
+# instead of a python loop per clause
+
+import os, mmap, gzip
+from array import array
+from itertools import chain
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+# letters only ever start comment and header lines
+specials = (b'c', b'p', b'%')
+
+chunk = 1 << 24
+write_chunk = 1 << 18
+
+class Dimacs(object):
+    "zero terminated literals, like the file, plus where the comments land"
+    def __init__(self):
+        self.lits = array('i')
+        self.comments = []  # (offset into lits, text)
+        self.terms = 0  # from the header, if there was one
+        self.clauses = 0
+        self.ended = False
+    def __iter__(self):
+        return self.clause_range(0, len(self.lits))
+    def __len__(self):
+        return self.lits.count(0)
+    def clause_range(self, start, end):
+        "tuple clauses between two offsets into lits"
+        clause = []
+        for n in self.lits[start:end]:
+            if n:
+                clause.append(n)
+                continue
+            yield tuple(clause)
+            clause = []
+        if clause:
+            yield tuple(clause)
+    def sections(self, first='beginning of file'):
+        "(comment, start, end) for each run of clauses after a comment"
+        bounds = [(0, first)] + self.comments
+        for i,(start,c) in enumerate(bounds):
+            if i + 1 < len(bounds):
+                end = bounds[i+1][0]
+            else:
+                end = len(self.lits)
+            yield c, start, end
+    def maxterm(self):
+        if not self.lits:
+            return 0
+        return max(max(self.lits), -min(self.lits))
+
+def raw_bytes(path):
+    "mmap where possible, gzip and xz are decompressed in memory"
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb').read()
+    if path.endswith('.xz'):
+        if lzma is None:
+            raise Exception("No lzma module for %s" % path)
+        return lzma.open(path, 'rb').read()
+    fh = open(path, 'rb')
+    if os.fstat(fh.fileno()).st_size == 0:
+        fh.close()
+        return b''
+    data = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+    fh.close()
+    return data
+
+def _body(lits, data, start, end):
+    "split the text between comment lines, in big slices"
+    while start < end:
+        stop = min(start + chunk, end)
+        if stop < end:
+            # never split a number
+            stop = max(data.rfind(b'\n', start, stop), data.rfind(b' ', start, stop)) + 1
+            if stop <= start:
+                stop = end
+        lits.extend(map(int, data[start:stop].split()))
+        start = stop
+
+def special_lines(data):
+    "(start, end) of each comment or header line, by plain searches"
+    found = dict((c, data.find(c)) for c in specials)
+    while True:
+        live = [i for i in found.values() if i != -1]
+        if not live:
+            return
+        i = min(live)
+        start = data.rfind(b'\n', 0, i) + 1
+        end = data.find(b'\n', i)
+        if end == -1:
+            end = len(data)
+        yield start, end
+        for c in specials:
+            if found[c] != -1 and found[c] < end:
+                found[c] = data.find(c, end)
+
+def parse(data, dimacs=None, partial=False):
+    "bytes (or an mmap) of a cnf into a Dimacs"
+    if dimacs is None:
+        dimacs = Dimacs()
+    lits = dimacs.lits
+    position = 0
+    for start, end in special_lines(data):
+        _body(lits, data, position, start)
+        position = end
+        line = data[start:end].strip()
+        if line[:1] == b'%':
+            # satlib end marker, followed by junk
+            position = len(data)
+            dimacs.ended = True
+            break
+        if line[:1] == b'p':
+            header = line.split()
+            dimacs.terms, dimacs.clauses = int(header[2]), int(header[3])
+        elif line[:1] == b'c':
+            text = line[1:].strip().decode('utf-8', 'replace')
+            # the padding under a fixed width header is a blank comment
+            if text:
+                dimacs.comments.append((len(lits), text))
+    _body(lits, data, position, len(data))
+    if lits and lits[-1] != 0 and not partial:
+        lits.append(0)
+    return dimacs
+
+def load(path):
+    data = raw_bytes(path)
+    dimacs = parse(data)
+    if isinstance(data, mmap.mmap):
+        data.close()
+    return dimacs
+
+def pieces(path, size=chunk):
+    "Dimacs for each slice of a big file, never splitting a clause"
+    data = raw_bytes(path)
+    tail = array('i')
+    start = 0
+    terms, clauses = 0, 0
+    while start < len(data):
+        stop = min(start + size, len(data))
+        if stop < len(data):
+            stop = data.find(b'\n', stop) + 1 or len(data)
+        piece = Dimacs()
+        piece.lits.extend(tail)
+        piece.terms, piece.clauses = terms, clauses
+        parse(data[start:stop], piece, partial=True)
+        terms, clauses = piece.terms, piece.clauses
+        start = stop
+        lits = piece.lits
+        cut = len(lits)
+        if start < len(data) and not piece.ended:
+            # carry an unfinished clause over
+            while cut and lits[cut-1] != 0:
+                cut -= 1
+        elif lits and lits[-1] != 0:
+            lits.append(0)
+            cut = len(lits)
+        tail = lits[cut:]
+        del lits[cut:]
+        piece.comments = [(min(i, cut), c) for i,c in piece.comments]
+        yield piece
+        if piece.ended:
+            break
+    if isinstance(data, mmap.mmap):
+        data.close()
+
+def remap(lits, table):
+    "new literals through a list of old term: new term"
+    # negatives index from the end of the mirrored list
+    full = list(table) + [-n for n in reversed(table[1:])]
+    return array('i', map(full.__getitem__, lits))
+
+def clauses(lits):
+    "tuple clauses of zero terminated literals"
+    clause = []
+    for n in lits:
+        if n:
+            clause.append(n)
+            continue
+        yield tuple(clause)
+        clause = []
+
+def write_range(fh, lits, start, end):
+    "dimacs text for a slice of zero terminated literals"
+    for i in range(start, end, write_chunk):
+        part = lits[i:min(i+write_chunk, end)]
+        if not part:
+            continue
+        # every 0 ends a line, also at the start of a chunk or alone
+        ends = ['\n' if n == 0 else ' ' for n in part]
+        fh.write(''.join(chain.from_iterable(zip(map(str, part), ends))))
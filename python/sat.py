@@ -4,22 +4,22 @@
 # works in python 2 or 3
 # GPLv3
 
-import os, time, shutil, tempfile, subprocess
+import os, sys, ast, time, atexit, shutil, tempfile, threading, subprocess
+from array import array
 from itertools import *
 from collections import defaultdict, deque
+import cdcl, dimacs
 
 # todo
 # more puzzle specific classes
-# auto_term saving and preloading
 # summary of automatic terms (debugging)
 # sanity check that all auto_terms are used?
 # hybrid manual/auto_term
-# portable auto_term that flattens and strings everything
 # maybe move the geometry stuff elsewhere
 # random prefix generation
 
 class CNF(object):
-    def __init__(self, path=None, stdout=False, preloads=None):
+    def __init__(self, path=None, stdout=False, preloads=None, buffered=False, compact=False):
         self.cnf_path = path
         if path is None:
             self.fh_cnf = tempfile.NamedTemporaryFile('w+', 1, delete=False)
@@ -35,28 +35,56 @@ class CNF(object):
             self.fh_cnf = open(self.cnf_path, 'w+', 1)
             self.fh_lut = open(self.lut_path, 'w+', 1)
             self.del_flag = False
-        self.fh_cnf.write('p cnf 0 0\n')
+            # finish the file before module teardown, __del__ is too late
+            atexit.register(self.close)
+        self.live_flag = True
+        self.fh_cnf.write(dimacs_header(0, 0))
         # adjust to whatever path and options you need
         self.custom_run = ''
         self.solver = self._run_minisat  # override this too
+        self._cdcl = None
+        self._cdcl_file = None
+        self.snapshot_mode = 'auto'  # auto, copy, reflink, overlay, stream
+        self._snapshot = None  # set while a Snapshot is being solved
+        self.portfolio = []  # for _run_portfolio
+        self.portfolio_winner = None
+        self.portfolio_wins = defaultdict(int)
         self.clauses = 0
         self.limit = 100000
         self.maxterm = 0
-        self.terms = set()
         self.stdout = stdout
         self.quiet = True
-        self.term_lut = {}
-        self.auto_history = []
+        # compact mode trades speed for memory on huge encodings
+        self.compact = compact
+        self._new_tables()
+        self._lut_pending = None  # from auto_term(load=), decoded on demand
+        self._auto_index = None  # position: value: labels, for auto_search
+        self._auto_lengths = None  # length: labels
         self.auto_mode = 'rw'  # rw, ro, wo
         self._auto_stack = []
+        self._prefix_count = 0
+        # drop duplicates and tautologies on write, 'subsume' also
+        # drops clauses already covered by a unit or binary clause
+        self.dedupe = False
+        self.removed = defaultdict(int)
+        self._seen_clauses = set()
+        self._units = set()
+        self._pairs = defaultdict(set)
+        # buffered mode keeps clauses in memory until a file is needed
+        self.buffered = buffered
+        self._lits = array('i')  # zero terminated, like dimacs
+        self._notes = []  # (offset into _lits, comment)
         if preloads is None:
             preloads = []
         for preload in preloads:
-            # todo, auto_term lut support
             self.comment('preloading %s' % preload)
-            shutil.copyfileobj(open(preload, 'rb'), self.fh_cnf)
+            self.splice(preload)
     def write(self, cnf):
         "consumes an iterator of tuple clauses"
+        if self.dedupe:
+            cnf = self._dedupe(cnf)
+        if self.buffered:
+            return self._write_buffered(cnf)
         for i,line in enumerate(cnf):
             line = list(line)
             if min(map(abs, line)) == 0:
@@ -71,27 +99,156 @@ class CNF(object):
                 print(output)
             self.clauses += 1
             self.terms.update(map(abs, line))
+    def _dedupe(self, cnf):
+        "filters out clauses that add nothing, see self.removed"
+        seen = self._seen_clauses
+        units = self._units
+        pairs = self._pairs
+        subsume = self.dedupe == 'subsume'
+        for line in cnf:
+            # helpers may hand over generators, set() would use them up
+            line = tuple(line)
+            s = set(line)
+            key = tuple(sorted(s))
+            reason = None
+            if key in seen:
+                reason = 'duplicate'
+            elif any(-n in s for n in s):
+                reason = 'tautology'
+            elif subsume and (any(n in units for n in s) or
+                              any(not pairs[n].isdisjoint(s) for n in s if n in pairs)):
+                reason = 'subsumed'
+            if reason is None:
+                seen.add(key)
+                if subsume and len(key) == 1:
+                    units.add(key[0])
+                if subsume and len(key) == 2:
+                    pairs[key[0]].add(key[1])
+                    pairs[key[1]].add(key[0])
+                yield line
+                continue
+            if 0 in s:
+                raise Exception("Illegal term, 0")
+            # keep the books as if it had been written
+            self.removed[reason] += 1
+            if key:
+                self.maxterm = max(self.maxterm, max(key), -min(key))
+                self.terms.update(map(abs, key))
+    def _write_buffered(self, cnf):
+        "bulk version of write(), terms are tallied in flush()"
+        lits = self._lits
+        start = len(lits)
+        added = 0
+        for line in cnf:
+            lits.extend(line)
+            lits.append(0)
+            added += 1
+            if self.stdout:
+                print(' '.join(map(str, list(line) + [0])))
+        if not added:
+            return
+        tail = lits[start:]
+        if tail.count(0) != added:
+            del lits[start:]
+            raise Exception("Illegal term, 0")
+        self.maxterm = max(self.maxterm, max(tail), -min(tail))
+        self.clauses += added
+    def flush(self):
+        "dump buffered clauses to the cnf file in one pass"
+        lits = self._lits
+        if not lits and not self._notes:
+            return
+        self.terms.update(map(abs, lits))
+        self.terms.discard(0)
+        notes = self._notes + [(len(lits), None)]
+        start = 0
+        for offset,c in notes:
+            dimacs.write_range(self.fh_cnf, lits, start, offset)
+            start = offset
+            if c is not None:
+                self.fh_cnf.write('c ' + c + '\n')
+        self._lits = array('i')
+        self._notes = []
     def read(self, path):
         "for external CNFs, no error checking"
-        for line in open(path):
-            if line[0] in ('c', 'p'):
+        loaded = dimacs.load(path)
+        if self.dedupe or self.stdout:
+            return self.write(iter(loaded))
+        lits = loaded.lits
+        if not lits:
+            return
+        # straight into the buffer, flush() takes care of the rest
+        self._lits.extend(lits)
+        self.maxterm = max(self.maxterm, loaded.maxterm())
+        self.clauses += lits.count(0)
+        if not self.buffered:
+            self.flush()
+    def splice(self, path):
+        "copy in another cnf, terms with the same label are shared"
+        # uses path.blut or path.lut when there is one
+        # unlabelled terms get fresh numbers, unless this cnf is empty
+        if path.endswith('.cnf'):
+            path = path[:-4]
+        fresh = not self.term_lut and self._lut_pending is None and self.maxterm == 0
+        table = None
+        if fresh and os.path.exists(path + '.blut'):
+            # same numbering, only the labels need loading
+            self.auto_term(load=path + '.blut')
+        elif not fresh or os.path.exists(path + '.lut'):
+            table = [0]  # old term: new term
+            labels = {}
+            if os.path.exists(path + '.blut'):
+                labels = dict(blut_labels(*read_blut(path + '.blut')[:2]))
+            elif os.path.exists(path + '.lut'):
+                labels = dict(text_lut_labels(path + '.lut'))
+            labelled = max([0] + list(labels))
+        for piece in dimacs.pieces(path + '.cnf'):
+            lits = piece.lits
+            if table is None:
+                self.maxterm = max(self.maxterm, piece.maxterm())
+            else:
+                terms = max(piece.terms, piece.maxterm(), labelled)
+                self.auto_stack_push('rw')
+                for n in range(len(table), terms + 1):
+                    if n in labels:
+                        table.append(self.auto_term(*labels[n]))
+                    else:
+                        self.maxterm += 1
+                        table.append(self.maxterm)
+                self.auto_stack_pop()
+                lits = dimacs.remap(lits, table)
+            if self.dedupe:
+                self.write(dimacs.clauses(lits))
                 continue
-            line = tuple(map(int, line.split()))[:-1]
-            self.write([line])
+            base = len(self._lits)
+            self._notes.extend((base + i, c) for i,c in piece.comments if c)
+            self._lits.extend(lits)
+            self.clauses += lits.count(0)
+            if not self.buffered:
+                self.flush()
     def write_one(self, *clause):
         "for single clauses"
         # breaks when passed a list...
         self.write([clause])
     def comment(self, c):
-        self.fh_cnf.write('c ' + c + '\n')
+        if self.buffered:
+            self._notes.append((len(self._lits), c))
+        else:
+            self.fh_cnf.write('c ' + c + '\n')
         self.fh_lut.write('# ' + c + '\n')
         if self.stdout or not self.quiet:
             print('c ' + c)
     def _close_cnf(self):
         "probably needed for os compatibility"
+        self.flush()
         self.fh_cnf.flush()
         os.fsync(self.fh_cnf.fileno())
         self.fh_cnf.close()
+        extra = 0
+        snap = self._snapshot
+        if snap is not None and snap.mode == 'overlay':
+            extra = snap.extra_clauses
+        patch_header(self.cnf_path, self.maxterm, self.clauses + extra)
     def _reopen_cnf(self):
         "probably needed for os compatibility"
         self.fh_cnf = open(self.cnf_path, 'a+', 1)
@@ -111,9 +268,7 @@ class CNF(object):
         if status == 3:
             raise Exception("Minisat return 3, input parsing failure")
         if status == 10:
-            solution = open(solve_path).readlines()[-1].strip()
-            solution = list(map(int, solution.split(' ')))
-            return set(n for n in solution if n > 0)
+            return minisat_model(solve_path)
         if status == 20:
             return False
         raise Exception("Unknown minisat return %i" % status)
@@ -129,11 +284,7 @@ class CNF(object):
         status = subprocess.call(cmd, stdout=pipe, stderr=pipe)
         self._reopen_cnf()
         if status == 10:
-            solution = set()
-            for line in open(solve_path):
-                solution.update(line.strip().split())
-            solution -= set(['s', 'SATISFIABLE', 'v'])
-            return set(int(n) for n in solution if int(n) > 0)
+            return picosat_model(solve_path)
         if status == 20:
             return False
         raise Exception("Unknown picosat return %i" % status)
@@ -152,43 +303,135 @@ class CNF(object):
         solution, _ = p.communicate()
         status = p.returncode
         if status == 10:
-            solution = solution.split('\n')
-            solution = [s for s in solution if s.startswith('v ')]
-            solution = solution[-1][2:]
-            solution = list(map(int, solution.split(' ')))
-            return set(n for n in solution if n > 0)
+            return cryptominisat_model(solution)
         if status == 20:
             return False
         if status == 15:
             raise Exception("Error: status not determined")
         raise Exception("Unknown cryptominisat return %i" % status)
+    def _run_portfolio(self, cnf_path, solve_path):
+        "race every solver in self.portfolio, first answer wins"
+        # portfolio entries are (kind, cmd), cmd is like custom_run
+        # kind is one of minisat, picosat, cryptominisat, cdcl
+        # [('minisat', ['minisat', '-rnd-seed=%i' % i]) for i in (1,2,3)]
+        if not self.portfolio:
+            raise Exception("Empty portfolio")
+        self._close_cnf()
+        racers = []
+        for i,(kind,cmd) in enumerate(self.portfolio):
+            if not cmd:
+                cmd = portfolio_kinds[kind][0]
+            if type(cmd) == str:
+                cmd = [cmd]
+            label = ' '.join(cmd)
+            out_path = '%s.%i' % (solve_path, i)
+            out = open(out_path + '.out', 'w')
+            cmd = list(cmd) + portfolio_kinds[kind][1](cnf_path, out_path)
+            try:
+                p = subprocess.Popen(cmd, stdout=out, stderr=subprocess.STDOUT)
+            except OSError:
+                # not installed, let the others race
+                out.close()
+                continue
+            racers.append((p, kind, label, out_path, out))
+        self._reopen_cnf()
+        result = None
+        try:
+            while result is None and racers:
+                time.sleep(0.005)
+                for racer in list(racers):
+                    p, kind, label, out_path, out = racer
+                    status = p.poll()
+                    if status is None:
+                        continue
+                    racers.remove(racer)
+                    out.close()
+                    if status not in (10, 20):
+                        continue
+                    result = False
+                    if status == 10:
+                        result = portfolio_kinds[kind][2](out_path)
+                    self.portfolio_winner = label
+                    self.portfolio_wins[label] += 1
+                    if not self.quiet:
+                        print('portfolio winner: ' + label)
+                    break
+        finally:
+            for p, _, _, _, out in racers:
+                p.kill()
+                p.wait()
+                out.close()
+            for i in range(len(self.portfolio)):
+                for path in ('%s.%i' % (solve_path, i), '%s.%i.out' % (solve_path, i)):
+                    if os.path.exists(path):
+                        os.remove(path)
+        if result is None:
+            raise Exception("No portfolio solver gave an answer")
+        return result
+    def _run_cdcl(self, cnf_path, solve_path):
+        "in-process solver, stays loaded while cnf_path only grows"
+        # solutions() appends blocking clauses, only the new tail is parsed
+        fh = open(cnf_path, 'rb')
+        stat = os.fstat(fh.fileno())
+        key = (cnf_path, stat.st_dev, stat.st_ino)
+        snap = self._snapshot
+        if snap is not None:
+            # overlays come and go on top of the base file
+            key += (snap.serial, snap.base_size)
+        if self._cdcl_file is None or self._cdcl_file[0] != key \
+          or self._cdcl_file[1] > stat.st_size:
+            self._cdcl = cdcl.Solver()
+            self._cdcl_file = (key, 0)
+            if snap is not None:
+                snap.fed = 0
+        fh.seek(self._cdcl_file[1])
+        data = fh.read()
+        fh.close()
+        data = data[:data.rfind(b'\n') + 1]
+        self._cdcl_file = (key, self._cdcl_file[1] + len(data))
+        solver = self._cdcl
+        solver.add_clauses(dimacs.parse(data))
+        if snap is not None and snap.mode == 'stream':
+            # streamed blocking clauses never reach the disk
+            solver.add_clauses(dimacs.parse(''.join(snap.extra[snap.fed:]).encode()))
+            snap.fed = len(snap.extra)
+        if not solver.solve():
+            return False
+        return solver.solution()
     def setup_temps(self):
         "returns temp paths, manually delete when done"
         temp2 = tempfile.NamedTemporaryFile(delete=False)
         copy_path = temp2.name
         temp2.close()
         self._close_cnf()
-        shutil.copy(self.cnf_path, copy_path)
+        if not clone_file(self.cnf_path, copy_path):
+            shutil.copy(self.cnf_path, copy_path)
         self._reopen_cnf()
         temp3 = tempfile.NamedTemporaryFile(delete=False)
         solve_path = temp3.name
         temp3.close()
         return copy_path, solve_path
     def verify(self, allow_partial = False):
-        if not min(self.terms) == 1:
+        self.flush()
+        lowest, highest = term_range(self.terms)
+        if not lowest == 1:
             raise Exception("CNF does not start at 1")
-        if not max(self.terms) == len(self.terms):
-            #print(max(self.terms), len(self.terms))
-            #print(set(range(1, max(self.terms)+1)) - self.terms)
-            print('gap size:', abs(max(self.terms) - len(self.terms)))
+        if not highest == len(self.terms):
+            #print(highest, len(self.terms))
+            #print(set(range(1, highest+1)) - self.terms)
+            print('gap size:', abs(highest - len(self.terms)))
+            self._restore_lut()
             for k,v in self.term_lut.items():
                 if v not in self.terms:
                     print(k)
             raise Exception("CNF has gaps")
-        cnf_path,solve_path  = self.setup_temps()
-        status = self.solver(cnf_path, solve_path)
-        os.remove(cnf_path)
-        os.remove(solve_path)
+        if self.removed and not self.quiet:
+            print('removed clauses: ' + ', '.join('%s %i' % kv for kv in sorted(self.removed.items())))
+        snap = Snapshot(self, self.snapshot_mode)
+        try:
+            status = snap.solve()
+        finally:
+            snap.remove()
         if status == False:
             raise Exception("No possible solutions")
         if allow_partial:
@@ -197,55 +440,108 @@ class CNF(object):
     def solutions(self, how_many=1, interesting=None, extreme_unique=False):
         "'interesting' is the subset of cells that matter for the solution"
         if interesting is None:
-            interesting = set([])
+            interesting = self._visible()
         interesting = set(interesting)
-        cnf_path,solve_path  = self.setup_temps()
-        for i in range(how_many):
-            solution = self.solver(cnf_path, solve_path)
-            if solution == False:
-                break
-            yield solution
-            if interesting:
-                solution = [n for n in solution if abs(n) in interesting]
-            negative = ' '.join(map(str, [-n for n in solution]))
-            if len(negative) == 0:
-                negative = ' '.join(str(n) for n in range(1, self.maxterm))
-            open(cnf_path, 'a').write(negative + ' 0\n')
-            # goofy, but occasionally useful
-            if extreme_unique:
-                for n in solution:
-                    if n <= 0:
-                        continue
-                    if interesting and n not in interesting:
-                        continue
-                    open(cnf_path, 'a').write('%i 0\n' % -n)
-        os.remove(cnf_path)
-        os.remove(solve_path)
+        snap = Snapshot(self, self.snapshot_mode)
+        try:
+            for i in range(how_many):
+                solution = snap.solve()
+                if solution == False:
+                    break
+                yield solution
+                if interesting:
+                    solution = [n for n in solution if abs(n) in interesting]
+                negative = ' '.join(map(str, [-n for n in solution]))
+                if len(negative) == 0:
+                    negative = ' '.join(str(n) for n in range(1, self.maxterm))
+                snap.append(negative + ' 0\n')
+                # goofy, but occasionally useful
+                if extreme_unique:
+                    for n in solution:
+                        if n <= 0:
+                            continue
+                        if interesting and n not in interesting:
+                            continue
+                        snap.append('%i 0\n' % -n)
+        finally:
+            snap.remove()
+    def count_solutions(self, interesting=None):
+        "number of distinct assignments to the interesting terms"
+        # projected model counting over 'interesting', all terms by default
+        # not quite len(list(solutions())), that blocks supersets of each answer
+        # window(8, 2, 3) has 84 assignments but solutions() only finds the 28 pairs
+        if not interesting:
+            interesting = self._visible() or range(1, self.maxterm + 1)
+        self._close_cnf()
+        data = open(self.cnf_path, 'rb').read()
+        self._reopen_cnf()
+        return cdcl.count_projected(cdcl.parse_dimacs(data), interesting)
+    def hide_terms(self, terms):
+        "leave loosely defined scratch terms out of the default solutions()"
+        self.hidden.update(terms)
+    def _visible(self):
+        if not self.hidden:
+            return []
+        return [n for n in range(1, self.maxterm + 1) if n not in self.hidden]
     def clear(self):
         "wipe the temp files, for interactive use only"
         self.fh_cnf.close()
         self.fh_cnf = open(self.cnf_path, 'w+', 1)
+        self.fh_cnf.write(dimacs_header(0, 0))
         self.fh_lut.close()
         self.fh_lut = open(self.lut_path, 'w+', 1)
         self.clauses = 0
         self.maxterm = 0
-        self.terms = set()
-        self.term_lut = {}
-        self.auto_history = []
+        self._new_tables()
+        self._lut_pending = None
+        self._auto_index = None
+        self._auto_lengths = None
+        self._prefix_count = 0
+        self.removed = defaultdict(int)
+        self._seen_clauses = set()
+        self._units = set()
+        self._pairs = defaultdict(set)
+        self._lits = array('i')
+        self._notes = []
     def close(self):
+        if self.live_flag and not self.del_flag:
+            self.flush()
+            self.fh_cnf.flush()
+            patch_header(self.cnf_path, self.maxterm, self.clauses)
+        if self.live_flag:
+            self.fh_cnf.close()
+            self.fh_lut.close()
         if self.del_flag:
             os.remove(self.cnf_path)
             os.remove(self.lut_path)
+        if hasattr(atexit, 'unregister'):
+            # otherwise the atexit table keeps every named cnf alive
+            atexit.unregister(self.close)
         self.del_flag = False
+        self.live_flag = False
     def __del__(self):
         self.close()
+    def _new_tables(self):
+        if self.compact:
+            self.terms = TermBitmap()
+            self.hidden = TermBitmap()
+            self.term_lut = CompactLut()
+            # the table already remembers the order
+            self.auto_history = self.term_lut
+        else:
+            self.terms = set()
+            self.hidden = set()
+            self.term_lut = {}
+            self.auto_history = []
     def auto_term(self, *args, **kw_args):
         "not portable between users, except for load='' and save='' kw args"
         # how to deal with arg ordering...
         if 'save' in kw_args:
-            return
+            return self._save_lut(kw_args['save'])
         if 'load' in kw_args:
-            return
+            return self._load_lut(kw_args['load'])
+        if self._lut_pending is not None:
+            self._restore_lut()
         if 'ordered' in kw_args and kw_args['ordered']==False:
             args = sorted(args)
         if args in self.term_lut:
@@ -255,24 +551,113 @@ class CNF(object):
             if 'w' not in self.auto_mode:
                 raise Exception("Error: ro label creation " + str(args))
         if args not in self.term_lut:
-            self.auto_history.append(args)
+            if not self.compact:
+                self.auto_history.append(args)
             self.term_lut[args] = self.maxterm + 1
             self.maxterm += 1
+            if self._auto_index is not None:
+                self._index_label(args)
             # should not be a tuple?
             lut_line = repr(args) + '\t' + repr(self.term_lut[args])
             if lut_line.startswith('#'):
                 lut_line = lut_line.replace('#', '\#', 1)
             self.fh_lut.write(lut_line + '\n')
         return self.term_lut[args]
-    def auto_search(self, *args):
-        "provide matching functions, returns terms"
-        # todo, regex or something less messy
-        # and allow for variable length matches
-        for term in self.term_lut:
-            if len(args) != len(term):
+    def _save_lut(self, path):
+        "binary lut, each label component is stored once"
+        self._restore_lut()
+        index = {}
+        reprs = []
+        ints = array('i')
+        for args,term in sorted(self.term_lut.items(), key=lambda kv: kv[1]):
+            ints.append(term)
+            ints.append(len(args))
+            for c in args:
+                key = (type(c), c)
+                if key not in index:
+                    r = repr(c)
+                    try:
+                        same = ast.literal_eval(r) == c
+                    except (ValueError, SyntaxError):
+                        same = False
+                    if not same:
+                        raise Exception("Label component can not be saved " + r)
+                    index[key] = len(reprs)
+                    reprs.append(r)
+                ints.append(index[key])
+        text = '\n'.join(reprs).encode('utf-8')
+        fh = open(path, 'wb')
+        fh.write(lut_magic)
+        fh.write(('%i %i %i %s\n' % (len(text), len(ints), self.maxterm, sys.byteorder)).encode('utf-8'))
+        fh.write(text)
+        ints.tofile(fh)
+        fh.close()
+    def _load_lut(self, path):
+        "the labels are only decoded when something needs them"
+        if self.term_lut or self._lut_pending is not None:
+            raise Exception("auto_term load needs an empty term table")
+        reprs, ints, maxterm = read_blut(path)
+        self._lut_pending = (reprs, ints)
+        self.maxterm = max(self.maxterm, maxterm)
+        # the text lut stays complete, built from the stored reprs
+        self.fh_lut.write('# auto_term load %s\n' % path)
+        lines = []
+        i = 0
+        while i < len(ints):
+            term, n = ints[i], ints[i+1]
+            parts = [reprs[j] for j in ints[i+2:i+2+n]]
+            label = '(' + ', '.join(parts) + (',)' if n == 1 else ')')
+            if label.startswith('#'):
+                label = '\\' + label
+            lines.append(label + '\t' + repr(term) + '\n')
+            i += 2 + n
+        self.fh_lut.writelines(lines)
+    def _restore_lut(self):
+        if self._lut_pending is None:
+            return
+        reprs, ints = self._lut_pending
+        self._lut_pending = None
+        for term, args in blut_labels(reprs, ints):
+            self.term_lut[args] = term
+            if not self.compact:
+                self.auto_history.append(args)
+            if self._auto_index is not None:
+                self._index_label(args)
+    def auto_search(self, *args, **kw_args):
+        "exact values, the any builtin as a wildcard or matching functions, returns labels"
+        # prefix=True also matches longer labels
+        self._restore_lut()
+        if self._auto_index is None:
+            self._auto_index = defaultdict(lambda: defaultdict(list))
+            self._auto_lengths = defaultdict(list)
+            for label in self.term_lut:
+                self._index_label(label)
+        prefix = kw_args.get('prefix', False)
+        exact = [(i,a) for i,a in enumerate(args) if a is not any and not callable(a)]
+        tests = [(i,a) for i,a in enumerate(args) if a is not any and callable(a)]
+        if exact:
+            # the shortest posting list, everything else is a filter
+            postings = [self._auto_index[i].get(a, []) for i,a in exact]
+            candidates = min(postings, key=len)
+        elif prefix:
+            candidates = chain.from_iterable(v for k,v in self._auto_lengths.items() if k >= len(args))
+        else:
+            candidates = self._auto_lengths.get(len(args), [])
+        for label in candidates:
+            if len(label) != len(args) and not (prefix and len(label) > len(args)):
+                continue
+            if any(label[i] != a for i,a in exact):
                 continue
-            if all(a(t) for a,t in zip(args, term)):
-                yield term
+            if all(a(label[i]) for i,a in tests):
+                yield label
+    def _index_label(self, label):
+        self._auto_lengths[len(label)].append(label)
+        for i,c in enumerate(label):
+            self._auto_index[i][c].append(label)
+    def auto_prefix(self, name='auto'):
+        "unique label prefix for helpers that need scratch terms"
+        self._prefix_count += 1
+        return '%s %i' % (name, self._prefix_count)
     def auto_stack_push(self, new_mode):
         "for internal functions to preserve user-set mode state"
         self._auto_stack.append(self.auto_mode)
@@ -281,6 +666,395 @@ class CNF(object):
         "for internal functions to preserve user-set mode state"
         self.auto_mode = self._auto_stack.pop()
 
+snapshot_serial = count()
+
+class Snapshot(object):
+    "private appendable view of a cnf, for verify() and solutions()"
+    # copy: full copy of the cnf, the old way
+    # reflink: copy-on-write clone, falls back to copy
+    # overlay: no copy, extra clauses are appended to the cnf itself
+    #     for the duration of each solve and truncated away afterwards
+    #     (so clauses written between solves are seen, unlike a copy)
+    #     opt-in only, an interrupted solve leaves the cnf file modified
+    # stream: no copy and the cnf is never modified, extra clauses stay in
+    #     memory and are handed straight to _run_cdcl, other solvers read
+    #     the cnf and the extra clauses through a named pipe
+    # auto: reflink if the filesystem can, otherwise stream, otherwise copy
+    def __init__(self, cnf, mode='auto'):
+        self.cnf = cnf
+        self.serial = next(snapshot_serial)
+        self.extra = []
+        self.extra_clauses = 0
+        self.base_size = None
+        self.fed = 0  # extra clauses _run_cdcl has already seen
+        temp = tempfile.NamedTemporaryFile(delete=False)
+        self.solve_path = temp.name
+        temp.close()
+        self.path = cnf.cnf_path
+        if mode == 'auto' and not streamable(cnf):
+            mode = 'reflink'
+        self.mode = mode
+        if mode in ('overlay', 'stream'):
+            return
+        temp = tempfile.NamedTemporaryFile(delete=False)
+        self.path = temp.name
+        temp.close()
+        cnf._close_cnf()
+        self.mode = 'copy'
+        if mode != 'copy' and clone_file(cnf.cnf_path, self.path):
+            self.mode = 'reflink'
+        elif mode == 'auto':
+            os.remove(self.path)
+            self.path = cnf.cnf_path
+            self.mode = 'stream'
+        else:
+            shutil.copy(cnf.cnf_path, self.path)
+        cnf._reopen_cnf()
+    def append(self, text, clauses=1):
+        "add dimacs text, mostly blocking clauses"
+        self.extra_clauses += clauses
+        if self.mode in ('overlay', 'stream'):
+            self.extra.append(text)
+            return
+        open(self.path, 'a').write(text)
+    def solve(self):
+        "run cnf.solver on the snapshot"
+        cnf = self.cnf
+        if self.mode == 'stream':
+            return self._solve_stream()
+        if self.mode != 'overlay':
+            patch_header(self.path, cnf.maxterm, cnf.clauses + self.extra_clauses)
+            cnf._snapshot = self
+            try:
+                return cnf.solver(self.path, self.solve_path)
+            finally:
+                cnf._snapshot = None
+        cnf._close_cnf()
+        self.base_size = os.path.getsize(self.path)
+        fh = open(self.path, 'a')
+        fh.write(''.join(self.extra))
+        fh.close()
+        patch_header(self.path, cnf.maxterm, cnf.clauses + self.extra_clauses)
+        cnf._snapshot = self
+        cnf._reopen_cnf()
+        try:
+            return cnf.solver(self.path, self.solve_path)
+        finally:
+            cnf._snapshot = None
+            cnf._close_cnf()
+            fh = open(self.path, 'r+')
+            fh.truncate(self.base_size)
+            fh.close()
+            cnf._reopen_cnf()
+    def _solve_stream(self):
+        cnf = self.cnf
+        cnf._close_cnf()
+        cnf._reopen_cnf()
+        cnf._snapshot = self
+        try:
+            if cnf.solver == cnf._run_cdcl:
+                # _run_cdcl picks the extra clauses up from self.extra
+                return cnf.solver(self.path, self.solve_path)
+            fifo = self.solve_path + '.cnf'
+            os.mkfifo(fifo)
+            writer = threading.Thread(target=self._stream, args=(fifo,))
+            writer.daemon = True
+            writer.start()
+            try:
+                return cnf.solver(fifo, self.solve_path)
+            finally:
+                if writer.is_alive():
+                    # the solver never opened the pipe, let the writer fail
+                    try:
+                        os.close(os.open(fifo, os.O_RDONLY | os.O_NONBLOCK))
+                    except OSError:
+                        pass
+                writer.join()
+                os.remove(fifo)
+        finally:
+            cnf._snapshot = None
+    def _stream(self, fifo):
+        "header, the base cnf without its header, then the extra clauses"
+        cnf = self.cnf
+        try:
+            fh = open(fifo, 'wb')
+            fh.write(dimacs_header(cnf.maxterm, cnf.clauses + self.extra_clauses).encode())
+            base = open(self.path, 'rb')
+            base.seek(header_size)
+            shutil.copyfileobj(base, fh)
+            base.close()
+            fh.write(''.join(self.extra).encode())
+            fh.close()
+        except (IOError, OSError):
+            # the solver quit without reading everything
+            pass
+    def remove(self):
+        if self.mode not in ('overlay', 'stream') and os.path.exists(self.path):
+            os.remove(self.path)
+        if os.path.exists(self.solve_path):
+            os.remove(self.solve_path)
+
+class CompactLut(object):
+    "label: term table without a tuple per label, for CNF(compact=True)"
+    # components are interned once, labels are runs of component numbers
+    # in one array, found through an open addressing table of label numbers
+    def __init__(self):
+        self.numbers = {}  # component: number
+        self.components = []  # number: component
+        self.parts = array('i')
+        self.starts = array('l', [0])
+        self.ids = array('i')
+        self.slots = array('l', [-1]) * 16
+    def __len__(self):
+        return len(self.ids)
+    def _encode(self, args, create=False):
+        codes = []
+        for c in args:
+            n = self.numbers.get(c)
+            if n is None:
+                if not create:
+                    return None
+                n = len(self.components)
+                self.numbers[c] = n
+                self.components.append(c)
+            codes.append(n)
+        return codes
+    def _codes(self, k):
+        return self.parts[self.starts[k]:self.starts[k+1]].tolist()
+    def _find(self, codes):
+        "slot index, holding -1 when missing"
+        slots = self.slots
+        mask = len(slots) - 1
+        i = hash(tuple(codes)) & mask
+        while slots[i] != -1 and self._codes(slots[i]) != codes:
+            i = (i + 1) & mask
+        return i
+    def _grow(self):
+        self.slots = array('l', [-1]) * (len(self.slots) * 2)
+        for k in range(len(self.ids)):
+            self.slots[self._find(self._codes(k))] = k
+    def __contains__(self, args):
+        codes = self._encode(args)
+        return codes is not None and self.slots[self._find(codes)] != -1
+    def get(self, args, default=None):
+        codes = self._encode(args)
+        if codes is None:
+            return default
+        k = self.slots[self._find(codes)]
+        if k == -1:
+            return default
+        return self.ids[k]
+    def __getitem__(self, args):
+        term = self.get(args)
+        if term is None:
+            raise KeyError(args)
+        return term
+    def __setitem__(self, args, term):
+        codes = self._encode(args, create=True)
+        i = self._find(codes)
+        if self.slots[i] != -1:
+            self.ids[self.slots[i]] = term
+            return
+        self.slots[i] = len(self.ids)
+        self.ids.append(term)
+        self.parts.extend(codes)
+        self.starts.append(len(self.parts))
+        if len(self.ids) * 2 > len(self.slots):
+            self._grow()
+    def __iter__(self):
+        "labels in the order they were made"
+        components = self.components
+        for k in range(len(self.ids)):
+            yield tuple(components[n] for n in self._codes(k))
+    def keys(self):
+        return iter(self)
+    def items(self):
+        return zip(self, self.ids)
+
+class TermBitmap(object):
+    "set of positive terms, one bit each"
+    def __init__(self):
+        self.bits = bytearray()
+        self.size = 0
+    def __len__(self):
+        return self.size
+    def __contains__(self, n):
+        return 0 <= n < len(self.bits) * 8 and bool(self.bits[n >> 3] & (1 << (n & 7)))
+    def add(self, n):
+        bits = self.bits
+        if n >= len(bits) * 8:
+            bits.extend(bytearray(max(len(bits), (n >> 3) + 1 - len(bits))))
+        if not bits[n >> 3] & (1 << (n & 7)):
+            bits[n >> 3] |= 1 << (n & 7)
+            self.size += 1
+    def update(self, terms):
+        add = self.add
+        terms = iter(terms)
+        while True:
+            batch = set(islice(terms, 1 << 16))
+            if not batch:
+                break
+            for n in batch:
+                add(n)
+    def discard(self, n):
+        if n in self:
+            self.bits[n >> 3] &= ~(1 << (n & 7)) & 0xFF
+            self.size -= 1
+    def __iter__(self):
+        for i,b in enumerate(self.bits):
+            if not b:
+                continue
+            for j in range(8):
+                if b & (1 << j):
+                    yield i * 8 + j
+    def lowest(self):
+        return next(iter(self))
+    def highest(self):
+        bits = self.bits
+        for i in range(len(bits) - 1, -1, -1):
+            if bits[i]:
+                return i * 8 + bits[i].bit_length() - 1
+        raise ValueError("empty TermBitmap")
+
+def read_blut(path):
+    "component reprs, the label array and maxterm of a binary lut"
+    fh = open(path, 'rb')
+    if fh.read(len(lut_magic)) != lut_magic:
+        raise Exception("Not a binary lut " + path)
+    size, length, maxterm, byteorder = fh.readline().decode('utf-8').split()
+    text = fh.read(int(size)).decode('utf-8')
+    ints = array('i')
+    ints.fromfile(fh, int(length))
+    fh.close()
+    if byteorder != sys.byteorder:
+        ints.byteswap()
+    reprs = text.split('\n') if text else []
+    return reprs, ints, int(maxterm)
+
+def blut_labels(reprs, ints):
+    "(term, label) pairs of a binary lut"
+    values = [ast.literal_eval(r) for r in reprs]
+    i = 0
+    while i < len(ints):
+        term, n = ints[i], ints[i+1]
+        yield term, tuple(values[j] for j in ints[i+2:i+2+n])
+        i += 2 + n
+
+def text_lut_labels(path):
+    "(term, label) pairs of a text lut"
+    for line in open(path):
+        line = line.rstrip('\n')
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('\\#'):
+            line = line[1:]
+        k,v = line.rsplit('\t', 1)
+        yield int(v), ast.literal_eval(k)
+
+def block(path, build, *args, **kw_args):
+    "build a cnf and its binary lut once, reuse with splice() or preloads"
+    # cls=Zebra etc picks the class handed to build
+    cls = kw_args.get('cls', CNF)
+    if path.endswith('.cnf'):
+        path = path[:-4]
+    stamp = 'block %s %r' % (getattr(build, '__name__', ''), args)
+    if os.path.exists(path + '.cnf') and os.path.exists(path + '.blut'):
+        for line in open(path + '.cnf'):
+            if line.startswith('p') or line[1:].strip() == '':
+                continue
+            if line[1:].strip() == stamp:
+                return path
+            break
+    cnf = cls(path)
+    cnf.comment(stamp)
+    build(cnf, *args)
+    cnf.auto_term(save=path + '.blut')
+    cnf.close()
+    return path
+
+def term_range(terms):
+    "lowest and highest term, for sets or bitmaps"
+    if isinstance(terms, TermBitmap):
+        return terms.lowest(), terms.highest()
+    return min(terms), max(terms)
+
+def streamable(cnf):
+    "can Snapshot feed this solver without a file of its own"
+    if cnf.solver == cnf._run_cdcl:
+        return True
+    # the portfolio has several readers, custom solvers might seek
+    if not hasattr(os, 'mkfifo'):
+        return False
+    return cnf.solver in (cnf._run_minisat, cnf._run_picosat, cnf._run_cryptominisat)
+
+def clone_file(src, dst):
+    "copy-on-write clone (btrfs, xfs, ...), returns False if unsupported"
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    fh_src = open(src, 'rb')
+    fh_dst = open(dst, 'wb')
+    try:
+        fcntl.ioctl(fh_dst.fileno(), 0x40049409, fh_src.fileno())  # FICLONE
+        return True
+    except (IOError, OSError):
+        return False
+    finally:
+        fh_src.close()
+        fh_dst.close()
+
+def minisat_model(solve_path):
+    solution = open(solve_path).readlines()[-1].strip()
+    solution = list(map(int, solution.split(' ')))
+    return set(n for n in solution if n > 0)
+
+def picosat_model(solve_path):
+    solution = set()
+    for line in open(solve_path):
+        solution.update(line.strip().split())
+    solution -= set(['s', 'SATISFIABLE', 'v'])
+    return set(int(n) for n in solution if int(n) > 0)
+
+def cryptominisat_model(stdout):
+    solution = stdout.split('\n')
+    solution = [s for s in solution if s.startswith('v ')]
+    solution = solution[-1][2:]
+    solution = list(map(int, solution.split(' ')))
+    return set(n for n in solution if n > 0)
+
+# kind: (default command, extra arguments, model reader)
+portfolio_kinds = {
+    'minisat': ('minisat', lambda cnf, out: [cnf, out], minisat_model),
+    'picosat': ('picosat', lambda cnf, out: ['-f', '-o', out, cnf], picosat_model),
+    'cryptominisat': ('cryptominisat', lambda cnf, out: [cnf],
+                      lambda out: cryptominisat_model(open(out + '.out').read())),
+    'cdcl': ([sys.executable, cdcl.__file__], lambda cnf, out: [cnf, out], minisat_model),
+    }
+
+# the header is padded out to a fixed size with a comment line
+# so that it can be rewritten in place as the formula grows
+header_size = 64
+
+lut_magic = b'sat.py binary lut 1\n'
+
+def dimacs_header(terms, clauses):
+    "fixed width 'p cnf' line"
+    header = 'p cnf %i %i\n' % (terms, clauses)
+    if len(header) + 2 > header_size:
+        raise Exception("Header does not fit in %i bytes: %s" % (header_size, header.strip()))
+    return header + 'c' + ' ' * (header_size - len(header) - 2) + '\n'
+
+def patch_header(path, terms, clauses):
+    "overwrite the reserved header, only works on files from dimacs_header()"
+    fh = open(path, 'r+')
+    if not fh.read(header_size).endswith('\n'):
+        fh.close()
+        raise Exception("No reserved header in %s" % path)
+    fh.seek(0)
+    fh.write(dimacs_header(terms, clauses))
+    fh.close()
+
 def write_cnf(cnf):
     for line in cnf:
         print(' '.join(map(str, list(line) + [0])))
@@ -303,15 +1077,239 @@ def sanity(cells):
 def neg(cells):
     return tuple(-c for c in cells)
 
-def window(cells, a, b):
+def window(cells, a, b, cnf=None, method='auto', prefix=None):
     "between a and b true, inclusive"
+    # with a cnf, large windows are encoded with auxiliary terms
+    # method is naive/sequential/totalizer/sorter or auto for the smallest
     cells = list(cells)
-    # lower limit
-    for cs in combinations(cells, len(cells)+1-a):
-        yield cs
-    # upper limit
-    for cs in combinations(cells, b+1):
-        yield neg(cs)
+    if cnf is not None and method == 'auto':
+        method = best_window(len(cells), a, b)
+    if cnf is None or method == 'naive':
+        # lower limit
+        for cs in combinations(cells, len(cells)+1-a):
+            yield cs
+        # upper limit
+        for cs in combinations(cells, b+1):
+            yield neg(cs)
+        return
+    if method in one_methods:
+        if b != 1 or a > 1:
+            raise Exception('%s only does window(0,1) and window(1,1)' % method)
+        for clause in one_clauses(aux_maker(cnf, prefix, method), cells, method, a == 1):
+            yield clause
+        return
+    n = len(cells)
+    if a > n:
+        yield ()
+        return
+    k = min(n, max(a, b+1))
+    outputs, clauses = counter_clauses(aux_maker(cnf, prefix, 'window'), cells, k, method)
+    for clause in clauses:
+        yield clause
+    if a > 0:
+        yield (outputs[a-1],)
+    if b < n:
+        yield (-outputs[b],)
+
+# the counters below fully define their auxiliary terms
+# so that solutions() doesn't report the same answer twice
+
+def aux_maker(cnf, prefix, name):
+    "returns a function that makes new scratch terms"
+    if prefix is None:
+        prefix = cnf.auto_prefix(name)
+    serial = count()
+    def new():
+        cnf.auto_stack_push('wo')
+        term = cnf.auto_term(prefix, next(serial))
+        cnf.auto_stack_pop()
+        return term
+    return new
+
+class ClauseCount(object):
+    "stands in for a clause list when only the size matters"
+    def __init__(self):
+        self.n = 0
+    def append(self, clause):
+        self.n += 1
+    def extend(self, clauses):
+        self.n += len(clauses)
+
+def counter_clauses(new, cells, k, method, clauses=None):
+    "returns (outputs, clauses), outputs[j-1] is true when at least j cells are"
+    if clauses is None:
+        clauses = []
+    if method == 'sequential':
+        outputs = _sequential(new, cells, k, clauses)
+    elif method == 'totalizer':
+        outputs = _totalizer(new, cells, k, clauses)
+    elif method == 'sorter':
+        outputs = _sorter(new, cells, clauses)[:k]
+    else:
+        raise Exception('unknown counter %s' % method)
+    return outputs, clauses
+
+def _sequential(new, cells, k, clauses):
+    "sinz style sequential counter"
+    if not cells or k == 0:
+        return []
+    prev = [cells[0]]
+    for x in cells[1:]:
+        row = []
+        for j in range(min(len(prev) + 1, k)):
+            t = new()
+            a = prev[j] if j < len(prev) else None
+            b = prev[j-1] if j > 0 else None
+            # t == a or (b and x)
+            if a is not None:
+                clauses.append((-a, t))
+                clauses.append((-t, a, x))
+            else:
+                clauses.append((-t, x))
+            if b is None:
+                clauses.append((-x, t))
+            else:
+                clauses.append((-b, -x, t))
+                clauses.append((-t, b) if a is None else (-t, a, b))
+            row.append(t)
+        prev = row
+    return prev[:k]
+
+def _totalizer(new, cells, k, clauses):
+    "bailleux and boufkhad totalizer, capped at k"
+    def merge(left, right):
+        p,q = len(left), len(right)
+        outputs = [new() for i in range(min(p+q, k))]
+        for i,l in product(range(p+1), range(q+1)):
+            if i + l == 0:
+                continue
+            # at least i on the left and l on the right
+            clause = [outputs[min(i+l, k) - 1]]
+            if i:
+                clause.append(-left[i-1])
+            if l:
+                clause.append(-right[l-1])
+            clauses.append(tuple(clause))
+        for i,l in product(range(p+1), range(q+1)):
+            if i + l >= len(outputs):
+                continue
+            # fewer than i+1 on the left and l+1 on the right
+            clause = [-outputs[i+l]]
+            if i < p:
+                clause.append(left[i])
+            if l < q:
+                clause.append(right[l])
+            clauses.append(tuple(clause))
+        return outputs
+    def build(cs):
+        if len(cs) == 1:
+            return list(cs)
+        half = len(cs) // 2
+        return merge(build(cs[:half]), build(cs[half:]))
+    if not cells or k == 0:
+        return []
+    return build(cells)[:k]
+
+def _sorter(new, cells, clauses):
+    "batcher odd-even merge sort, None pads to a power of two"
+    def compare(a, b):
+        if a is None:
+            return b, a
+        if b is None:
+            return a, b
+        hi, lo = new(), new()
+        clauses.extend([(-a, hi), (-b, hi), (-hi, a, b)])
+        clauses.extend([(-lo, a), (-lo, b), (-a, -b, lo)])
+        return hi, lo
+    def merge(xs, ys):
+        if len(xs) == 1:
+            return list(compare(xs[0], ys[0]))
+        evens = merge(xs[0::2], ys[0::2])
+        odds = merge(xs[1::2], ys[1::2])
+        out = [evens[0]]
+        for o,e in zip(odds[:-1], evens[1:]):
+            out.extend(compare(o, e))
+        out.append(odds[-1])
+        return out
+    def sort(xs):
+        if len(xs) == 1:
+            return xs
+        half = len(xs) // 2
+        return merge(sort(xs[:half]), sort(xs[half:]))
+    if not cells:
+        return []
+    size = 1
+    while size < len(cells):
+        size *= 2
+    outputs = sort(list(cells) + [None] * (size - len(cells)))
+    return outputs[:len(cells)]
+
+def choose(n, r):
+    if r < 0 or r > n:
+        return 0
+    total = 1
+    for i in range(min(r, n-r)):
+        total = total * (n-i) // (i+1)
+    return total
+
+def window_cost(n, a, b, method):
+    "clause count of window() for n cells"
+    if method == 'naive':
+        return choose(n, n+1-a) + choose(n, b+1)
+    if method in one_methods:
+        clauses = ClauseCount()
+        serial = count(n+1)
+        one_clauses(lambda: next(serial), list(range(1, n+1)), method, a == 1, clauses)
+        return clauses.n
+    k = min(n, max(a, b+1))
+    units = int(0 < a <= n) + int(b < n)
+    if method == 'sequential':
+        total = 0
+        for i in range(2, n+1):
+            row, prev = min(i, k), min(i-1, k)
+            total += prev + 3*row - 1
+        return total + units
+    if method == 'totalizer':
+        def build(m):
+            if m == 1:
+                return 1, 0
+            p, cost_l = build(m // 2)
+            q, cost_r = build(m - m // 2)
+            outputs = min(p+q, k)
+            down = sum(min(s, p) - max(0, s-q) + 1 for s in range(outputs))
+            return outputs, cost_l + cost_r + (p+1)*(q+1) - 1 + down
+        return build(n)[1] + units if n else units
+    # dry run with throwaway terms
+    serial = count(1)
+    clauses = ClauseCount()
+    counter_clauses(lambda: next(serial), list(range(1, n+1)), k, method, clauses)
+    return clauses.n + units
+
+best_windows = {}  # (n, a, b): method, puzzles ask for the same few
+
+def best_window(n, a, b):
+    "cheapest window() method, naive wins ties"
+    key = (n, a, b)
+    if key in best_windows:
+        return best_windows[key]
+    methods = ('naive', 'sequential', 'totalizer', 'sorter')
+    if b == 1 and a <= 1:
+        methods += one_methods
+    costs = [(window_cost(n, a, b, m), i, m) for i,m in enumerate(methods)]
+    best_windows[key] = min(costs)[2]
+    return best_windows[key]
+
+def tally(cnf, cells, k, method='auto', prefix=None):
+    "writes a counter, returns terms for 'at least 1' up to 'at least k'"
+    cells = list(cells)
+    k = min(k, len(cells))
+    if method == 'auto':
+        costs = [(window_cost(len(cells), k, k-1, m), m) for m in
+                 ('sequential', 'totalizer', 'sorter')]
+        method = min(costs)[1]
+    outputs, clauses = counter_clauses(aux_maker(cnf, prefix, 'tally'), cells, k, method)
+    cnf.write(clauses)
+    return outputs
 
 def xnor(a, b):
     "both false or both true"
@@ -327,18 +1325,40 @@ def ordered(cells1, cells2):
         for c2 in cells2[:i+1]:
             yield (-cells1[i], -c2)
 
-def maybe(cells, n):
+def maybe(cells, n, cnf=None):
     "generalized xnor, 0 or n true"
+    # with a cnf, big ones use a counter with auxiliary terms
     cells = list(cells)
-    cells_set = set(cells)
+    if cnf is not None and n == 1:
+        for clause in window(cells, 0, 1, cnf=cnf):
+            yield clause
+        return
+    if cnf is not None and 1 < n < len(cells):
+        m = len(cells)
+        naive = choose(m, n+1) + m * choose(m-1, m+1-n)
+        costs = [(window_cost(m, 0, n, method) + 1, method) for method in
+                 ('sequential', 'totalizer', 'sorter')]
+        cost, method = min(costs)
+        if cost < naive:
+            new = aux_maker(cnf, None, 'maybe')
+            outputs, clauses = counter_clauses(new, cells, n+1, method)
+            for clause in clauses:
+                yield clause
+            # any means n, never more
+            yield (-outputs[0], outputs[n-1])
+            yield (-outputs[n],)
+            return
     # upper limit
     for cs in combinations(cells, n+1):
         yield neg(cs)
     if n == 1:
         return
-    # lower limit
-    for cs in combinations(cells, len(cells)+1-n):
-        yield cs + neg(cells_set - set(cs))
+    # lower limit, any true means n-1 of the others are too
+    # (older versions only ruled out exactly n-1 and let 1 to n-2 through)
+    for i,c in enumerate(cells):
+        others = cells[:i] + cells[i+1:]
+        for cs in combinations(others, len(others)+1-(n-1)):
+            yield (-c,) + cs
 
 def link(*cells):
     "force equivalency, all false or all true"
@@ -370,9 +1390,20 @@ def consecutive(cells1, cells2, circular=False):
         yield (-cells1[-1],)
         yield (-cells2[0],)
 
-def adjacent(cells1, cells2, circular=False):
-    # todo, make be O(n) again
+def adjacent(cells1, cells2, circular=False, cnf=None):
+    # with a cnf, long ones are O(n) with prefix/suffix terms
     assert len(cells1) == len(cells2)
+    if cnf is not None:
+        n = len(cells1)
+        naive = n*n - 2*(n-1) - 2*int(circular and n > 2)
+        linear = ClauseCount()
+        serial = count(1)
+        _adjacent(lambda: next(serial), list(range(n)), list(range(n)), circular, linear)
+        if linear.n < naive:
+            new = aux_maker(cnf, None, 'adjacent')
+            for clause in _adjacent(new, list(cells1), list(cells2), circular, []):
+                yield clause
+            return
     for i1,i2 in product(range(len(cells1)), range(len(cells2))):
         if i1+1 == i2:
             continue
@@ -384,6 +1415,38 @@ def adjacent(cells1, cells2, circular=False):
             continue
         yield(-cells1[i1], -cells2[i2])
 
+def _adjacent(new, cells1, cells2, circular, clauses):
+    "linear adjacent(), returns the clauses"
+    n = len(cells1)
+    # before[j] is any of cells2[:j+1], after[j] is any of cells2[j:]
+    before = [cells2[0]]
+    for j in range(1, n-2):
+        before.append(_chain_or(new, before[-1], cells2[j], clauses))
+    after = [None] * n
+    after[n-1] = cells2[n-1]
+    for j in range(n-2, 1, -1):
+        after[j] = _chain_or(new, after[j+1], cells2[j], clauses)
+    for i in range(n):
+        clauses.append((-cells1[i], -cells2[i]))
+        if circular and n > 2 and i in (0, n-1):
+            # wrapping neighbors, spelled out
+            near = set([(i-1) % n, (i+1) % n, i])
+            for j in range(n):
+                if j not in near:
+                    clauses.append((-cells1[i], -cells2[j]))
+            continue
+        if i >= 2:
+            clauses.append((-cells1[i], -before[i-2]))
+        if i + 2 <= n - 1:
+            clauses.append((-cells1[i], -after[i+2]))
+    return clauses
+
+def _chain_or(new, a, b, clauses):
+    "new term that is a or b"
+    c = new()
+    clauses.extend([(-a, c), (-b, c), (-c, a, b)])
+    return c
+
 def not_adjacent(cells1, cells2, circular=False):
     assert len(cells1) == len(cells2)
     for i in range(len(cells1)):
@@ -442,9 +1505,13 @@ def one_or_three(cells):
 
 class Zebra(CNF):
     "handles everything for a zebra puzzle"
-    def load_axes(self, values, size=None, unconstrained=None):
+    def load_axes(self, values, size=None, unconstrained=None, cache=None, domain=None):
         "takes a dictionary of lists"
         # uncons. is an experimental feature to let tags to exist multiple times
+        # cache is a path, the grid rules are built there once and spliced in
+        # domain names a reference axis (or True for the first full one)
+        # every other axis becomes a permutation of it
+        # and f() defines the other pairs on demand
         self.everything = values
         self.all_sets = list(values.values())
         self.dims = len(values)
@@ -454,8 +1521,21 @@ class Zebra(CNF):
             self.size = len(self.all_sets[0])
         self.keys = [v for vals in values.values() for v in vals]
         assert len(self.keys) == len(list(set(self.keys)))
-        self._sanity_check()
-        self._grid_rules()
+        # f() is called for every clue, these keep it to dict lookups
+        self.key_index = dict((k,i) for i,k in enumerate(self.keys))
+        self.axis_of = dict((t,k) for k,v in values.items() for t in v)
+        self._f_cache = {}
+        self.reference = None
+        if domain is not None:
+            self._domain_setup(domain)
+        if cache is not None:
+            self.splice(block(cache, Zebra.load_axes, values, size, unconstrained, None, domain, cls=Zebra))
+        if domain is None:
+            self._sanity_check()
+        if cache is None and domain is None:
+            self._grid_rules()
+        if cache is None and domain is not None:
+            self._domain_rules()
     def _sanity_check(self):
         cells = []
         for a_keys, b_keys in combinations(self.all_sets, 2):
@@ -476,7 +1556,7 @@ class Zebra(CNF):
                 cells = [f(a,b) for b in b_keys if b not in uncon]
                 if not cells:
                     continue
-                self.write(window(cells, 1, 1))
+                self.write(window(cells, 1, 1, cnf=self))
             for b in b_keys:
                 if len(b_keys) != self.size:
                     break
@@ -485,7 +1565,7 @@ class Zebra(CNF):
                 cells = [f(a,b) for a in a_keys if a not in uncon]
                 if not cells:
                     continue
-                self.write(window(cells, 1, 1))
+                self.write(window(cells, 1, 1, cnf=self))
         self.comment('links in triples')
         # two of three not allowed, unless lopsided
         for ak, bk, ck in combinations(self.all_sets, 3):
@@ -497,20 +1577,89 @@ class Zebra(CNF):
                     self.write_one(-c1, c2, -c3)
                 if len(ak) == self.size and a not in uncon:
                     self.write_one(-c1, -c2, c3)
+    def _domain_setup(self, domain):
+        if self.unconstrained:
+            raise Exception("No unconstrained tags in domain mode")
+        if domain is True:
+            domain = [k for k,v in self.everything.items() if len(v) == self.size][0]
+        if len(self.everything[domain]) != self.size:
+            raise Exception("Reference axis must be full size")
+        if any(len(v) > self.size for v in self.everything.values()):
+            raise Exception("Axis larger than the reference")
+        self.reference = domain
+    def _domain_rules(self):
+        ref = self.everything[self.reference]
+        others = [v for k,v in self.everything.items() if k != self.reference]
+        self.comment('one reference per tag')
+        for tags in others:
+            # tags of a lopsided axis can share references
+            if len(tags) != self.size:
+                continue
+            for t in tags:
+                self.write(window([self.f(t,r) for r in ref], 1, 1, cnf=self))
+        self.comment('one tag per reference')
+        for tags in others:
+            for r in ref:
+                self.write(window([self.f(t,r) for t in tags], 1, 1, cnf=self))
+    def _pair(self, a, b):
+        "both tags at the same reference, O(size) clauses"
+        # a full axis tag has exactly one reference, which makes these exact
+        self.auto_stack_push('rw')
+        e = self.auto_term(a, b)
+        if len(self.everything[self.axis_of[a]]) != self.size:
+            a, b = b, a
+        full = len(self.everything[self.axis_of[a]]) == self.size
+        for r in self.everything[self.reference]:
+            pa, pb = self.f(a, r), self.f(b, r)
+            if full:
+                self.write([(-e, -pa, pb), (e, -pa, -pb)])
+                continue
+            # two lopsided tags can meet at several references
+            z = self.auto_term(a, b, r)
+            self.write([(-z, pa), (-z, pb), (z, -pa, -pb), (-z, e)])
+        if not full:
+            self.write_one(-e, *[self.auto_term(a, b, r) for r in self.everything[self.reference]])
+        self.auto_stack_pop()
+        return e
+    def _positions(self, t, solution):
+        if self.axis_of[t] == self.reference:
+            return set([t])
+        return set(r for r in self.everything[self.reference] if self.f(t, r) in solution)
+    def _same(self, a, b, solution):
+        if self.reference is None:
+            return self.f(a,b) in solution
+        return bool(self._positions(a, solution) & self._positions(b, solution))
+    def clear(self):
+        "wipe the temp files, for interactive use only"
+        CNF.clear(self)
+        # the cached terms belong to the old table
+        self._f_cache = {}
     def _key_sort(self, a, b):
-        if self.keys.index(a) > self.keys.index(b):
+        if self.key_index[a] > self.key_index[b]:
             return b, a
         return a, b
     def f(self, a, b):
+        if (a, b) in self._f_cache:
+            return self._f_cache[(a, b)]
         a,b = self._key_sort(a, b)
-        return self.auto_term(a, b)
+        if self.reference is None or self.reference in (self.axis_of[a], self.axis_of[b]):
+            term = self.auto_term(a, b)
+        else:
+            self._restore_lut()
+            if (a, b) in self.term_lut:
+                term = self.auto_term(a, b)
+            else:
+                term = self._pair(a, b)
+        self._f_cache[(a, b)] = term
+        self._f_cache[(b, a)] = term
+        return term
     def show(self, axes, num=3):
         "takes an ordered list of axes"
         for solution in self.solutions(num):
             for a in self.everything[axes[0]]:
                 line = [a]
                 for axe in axes[1:]:
-                    line += [b for b in self.everything[axe] if self.f(a,b) in solution]
+                    line += [b for b in self.everything[axe] if self._same(a, b, solution)]
                 print(' '.join(line))
             print('\n') 
 
@@ -523,6 +1672,7 @@ class Sequence(CNF):
         self.pages = pages
         self.ticks = ['time%i' % i for i in range(1, len(list(pages))+1)]
         self.page_comments = {}
+        self.kind = dict([(e, 'event') for e in events] + [(p, 'page') for p in pages])
         self._grid_rules()
     def _grid_rules(self):
         f = self.auto_term
@@ -534,23 +1684,24 @@ class Sequence(CNF):
             f(t, e, 'state')
             f(t, e, 'transition')
         self.auto_mode = 'ro'
+        self._term_arrays()
         self.comment('each event once')
-        for t in self.ticks:
-            cells = [f(t,p) for p in self.pages]
-            self.write(window(cells, 1, 1))
+        for i in range(len(self.ticks)):
+            cells = [self.placed[p][i] for p in self.pages]
+            self.write(window(cells, 1, 1, cnf=self))
         for p in self.pages:
-            cells = [f(t,p) for t in self.ticks]
-            self.write(window(cells, 1, 1))
+            self.write(window(list(self.placed[p]), 1, 1, cnf=self))
         for e in self.events:
-            cells = [f(t, e, 'transition') for t in self.ticks]
-            self.write(window(cells, 0, 1))
+            self.write(window(list(self.transition[e]), 0, 1, cnf=self))
         self.comment('time links')
         for e in self.events:
-            for t1,t2 in zip(self.ticks[:-1], self.ticks[1:]):
-                c1 = f(t1, e, 'state')
-                c2 = f(t1, e, 'transition')
-                c3 = f(t2, e, 'state')
-                c4 = f(t2, e, 'transition')
+            states = self.state[e]
+            transitions = self.transition[e]
+            for i in range(len(self.ticks) - 1):
+                c1 = states[i]
+                c2 = transitions[i]
+                c3 = states[i+1]
+                c4 = transitions[i+1]
                 self.write_one(-c2,  c1)
                 self.write_one(-c4,  c3)
                 self.write_one(-c1,  c3)
@@ -558,14 +1709,28 @@ class Sequence(CNF):
                 self.write_one( c1,  c4, -c3)
         self.comment('initial state')
         for e in self.events:
-            self.write(if_gen(f('time1', e, 'transition'), f('time1', e, 'state'), bidirectional=True))
+            self.write(if_gen(self.transition[e][0], self.state[e][0], bidirectional=True))
         self.auto_stack_pop()
+    def _term_arrays(self):
+        "per-tick terms, clues index these instead of calling auto_term"
+        f = self.auto_term
+        self.placed = dict((p, array('i', [f(t, p) for t in self.ticks])) for p in self.pages)
+        self.state = dict((e, array('i', [f(t, e, 'state') for t in self.ticks])) for e in self.events)
+        self.transition = dict((e, array('i', [f(t, e, 'transition') for t in self.ticks])) for e in self.events)
+    def clear(self):
+        "wipe the temp files, for interactive use only"
+        CNF.clear(self)
+        # the arrays belong to the old table, f() gets fresh terms
+        if hasattr(self, 'ticks'):
+            self.auto_stack_push('rw')
+            self._term_arrays()
+            self.auto_stack_pop()
     def every_event_happens(self):
         for e in self.events:
-            self.write_one(self.auto_term(self.ticks[-1], e, 'state'))
+            self.write_one(self.state[e][-1])
     def every_page_busy(self):
-        for t in self.ticks:
-            self.write_one(*[self.auto_term(t, e, 'transition') for e in self.events])
+        for i in range(len(self.ticks)):
+            self.write_one(*[self.transition[e][i] for e in self.events])
     def page_comment(self, page, comment):
         if page not in self.pages:
             raise Exception('bad page %s' % page)
@@ -580,25 +1745,23 @@ class Sequence(CNF):
         "single event, mode is (before during after), single event/page"
         if mode not in ['before', 'during', 'after']:
             raise Exception('bad mode %s' % mode)
-        if thing1 not in self.events + self.pages:
+        if thing1 not in self.kind:
             raise Exception('bad thing %s' % thing1)
-        if thing2 not in self.events + self.pages:
+        if thing2 not in self.kind:
             raise Exception('bad thing %s' % thing2)
-        if thing1 in self.events and thing2 in self.pages:
+        kinds = (self.kind[thing1], self.kind[thing2])
+        if kinds == ('event', 'page'):
             return self.f2(thing1, mode, thing2)
-        if thing1 in self.pages and thing2 in self.events:
+        if kinds == ('page', 'event'):
             inv_mode = {'before':'after', 'during':'during', 'after':'before'}
             return self.f2(thing2, inv_mode[mode], thing1)
-        if thing1 in self.events and thing2 in self.events:
+        if kinds == ('event', 'event'):
             return self.f3(thing1, mode, thing2)
-        if thing1 in self.pages and thing2 in self.pages:
+        if kinds == ('page', 'page'):
             return self.f4(thing1, mode, thing2)
         raise Exception('new f() combo?')
     def f2(self, event, mode, page):
-        for t in self.ticks:
-            s1 = self.auto_term(t, event, 'state')
-            t1 = self.auto_term(t, event, 'transition')
-            p1 = self.auto_term(t, page)
+        for s1, t1, p1 in zip(self.state[event], self.transition[event], self.placed[page]):
             if mode == 'before':
                 self.write(if_gen(p1, s1, bidirectional=False))
                 self.write(if_gen(-s1, -p1, bidirectional=False))
@@ -612,11 +1775,9 @@ class Sequence(CNF):
                 self.write(if_gen(p1, -t1, bidirectional=False))
                 self.write(if_gen(t1, -p1, bidirectional=False))
     def f3(self, event1, mode, event2):
-        for t in self.ticks:
-            s1 = self.auto_term(t, event1, 'state')
-            s2 = self.auto_term(t, event2, 'state')
-            t1 = self.auto_term(t, event1, 'transition')
-            t2 = self.auto_term(t, event2, 'transition')
+        terms = zip(self.state[event1], self.state[event2],
+                    self.transition[event1], self.transition[event2])
+        for s1, s2, t1, t2 in terms:
             if mode == 'before':
                 self.write(if_gen(s2, s1, bidirectional=False))
                 self.write(if_gen(-s1, -s2, bidirectional=False))
@@ -631,32 +1792,38 @@ class Sequence(CNF):
     def f4(self, page1, mode, page2):
         if mode == 'during':
             raise Exception('bad mode %s' % mode)
-        for i,t1 in enumerate(self.ticks):
-            for j,t2 in enumerate(self.ticks):
-                if t1 == t2:
+        for i,p1 in enumerate(self.placed[page1]):
+            for j,p2 in enumerate(self.placed[page2]):
+                if i == j:
                     continue
                 if mode == 'before' and i < j:
                     continue
                 if mode == 'after' and i > j:
                     continue
-                p1 = self.auto_term(t1, page1)
-                p2 = self.auto_term(t2, page2)
                 self.write_one(-p1, -p2)
-    def tally_state(self, n, events, page):
-        for t in self.ticks:
-            cells = [self.auto_term(t, e, 'state') for e in events]
-            p = self.auto_term(t, page)
+    def _tally(self, n, cells, p):
+        "if p then exactly n cells"
+        if best_window(len(cells), n, n) == 'naive':
             for line in window(cells, n, n):
                 self.write([[-p] + list(line)])
+            return
+        # the counter itself is unconditional, only the limits depend on p
+        outputs = tally(self, cells, n+1)
+        if n > 0:
+            self.write_one(-p, outputs[n-1])
+        if n < len(cells):
+            self.write_one(-p, -outputs[n])
+    def tally_state(self, n, events, page):
+        for i,p in enumerate(self.placed[page]):
+            cells = [self.state[e][i] for e in events]
+            self._tally(n, cells, p)
     def tally_transition(self, n, events, page):
-        for t in self.ticks:
-            cells = [self.auto_term(t, e, 'transition') for e in events]
-            p = self.auto_term(t, page)
-            for line in window(cells, n, n):
-                self.write([[-p] + list(line)])
+        for i,p in enumerate(self.placed[page]):
+            cells = [self.transition[e][i] for e in events]
+            self._tally(n, cells, p)
     def nth_page(self, page, n):
         "n=0 for first, n=-1 for last"
-        self.write_one(self.auto_term(self.ticks[n], page))
+        self.write_one(self.placed[page][n])
     def ordered(self, events):
         "list of events from oldest to newest"
         for e1, e2 in zip(events[:-1], events[1:]):
@@ -782,69 +1949,318 @@ def expand(adj, cells):
 # might not work quite right with tuple keys in the base
 # probably needs an option for slitherlink style fills
 
+def adjacency_arrays(adj):
+    "cell list, cell:id dict and neighbor id lists of an adj table"
+    cells = list(adj.keys())
+    index = dict((c,i) for i,c in enumerate(cells))
+    nbrs = [[index[c2] for c2 in adj[c] if c2 in index and c2 != c] for c in cells]
+    return cells, index, nbrs
+
+def bfs_distances(nbrs, starts, limit=None):
+    "steps from the nearest start id, -1 if not reached within limit"
+    dist = array('i', [-1]) * len(nbrs)
+    queue = deque(starts)
+    for i in starts:
+        dist[i] = 0
+    while queue:
+        i = queue.popleft()
+        if limit is not None and dist[i] + 1 >= limit:
+            continue
+        for j in nbrs[i]:
+            if dist[j] == -1:
+                dist[j] = dist[i] + 1
+                queue.append(j)
+    return dist
+
 def floodfill(cnf, prefix, adj, size, exact=False, seed=None, wrap=False):
     "cnf object, unique prefix, adjacent table, z size, exact size, seed label.  returns summary labels"
+    # a cell only gets layers it can reach from the seed, the rest is dead
+    # exact fills track 'reach' terms (in any layer so far) to keep clauses short
+    # wrap makes the first cell a neighbor of the last one
     assert not(not exact and wrap)
-    base = set(adj.keys())
+    cells, index, nbrs = adjacency_arrays(adj)
     if seed is None:
-        cells = base
+        starts = list(range(len(cells)))
     else:
-        cells = set([seed])
-    volume = set()
+        starts = [index[seed]]
+    dist = bfs_distances(nbrs, starts, limit=size)
+    live = [i for i in range(len(cells)) if dist[i] != -1]
     f = cnf.auto_term
+    cnf.auto_stack_push(cnf.auto_mode)
     method = ('unbounded', 'exact')[exact]
     method += ' ' + ('unbounded', 'wrap-around')[wrap]
     cnf.comment('%s %s flood fill, size %i' % (prefix, method, size))
+    # volume[i][layer] is a term, or 0 below the cell's distance
+    volume = [None] * len(cells)
+    reach = [None] * len(cells)
+    for i in live:
+        volume[i] = array('i', [0]) * size
+        if exact:
+            reach[i] = array('i', [0]) * size
+        for layer in range(dist[i], size):
+            volume[i][layer] = f(prefix, cells[i], layer)
     for layer in range(size):
-        # starting layer
-        cells2 = [(prefix,c,layer) for c in cells]
-        volume |= set(cells2)
-        # single starting point
-        if layer == 0:
-            cnf.write(window([f(*c2) for c2 in cells2], 1, 1))
-        if layer == 0 and not wrap:
-            cells = expand(adj, cells)
+        ring = [volume[i][layer] for i in live if dist[i] <= layer]
+        # single starting point, and always one per layer if exact
+        if layer == 0 or exact:
+            cnf.write(window(ring, 1, 1, cnf=cnf))
+    for i in live:
+        if not exact:
             continue
-        if exact and layer > 0:
-            # always one per layer
-            cnf.write(window([f(*c2) for c2 in cells2], 1, 1))
-        # growth rules
-        prev_layer = (layer - 1) % size
-        for c in cells:
-            cells3 = expand(adj, [c])
+        column = volume[i]
+        reach[i][dist[i]] = column[dist[i]]
+        for layer in range(dist[i]+1, size):
+            r = f(prefix, 'reach', cells[i], layer)
+            reach[i][layer] = r
+            before = reach[i][layer-1]
+            # at most one per column
+            cnf.write([(-column[layer], -before), (-before, r), (-column[layer], r),
+                       (-r, before, column[layer])])
+    for i in live:
+        column = volume[i]
+        d = dist[i]
+        for layer in range(max(d, 1), size):
             if exact:
-                # if none in previous layers, then not you
-                cells3.discard(c)
-                cells3 = set((prefix,c3,l3) for c3,l3 in product(cells3, range(layer)))
+                # if no neighbor in previous layers, then not you
+                under = [reach[j][layer-1] for j in nbrs[i] if 0 <= dist[j] < layer]
             else:
                 # if under you, then also you
-                cnf.write(if_then(f(prefix,c,prev_layer), f(prefix,c,layer)))
+                if layer > d:
+                    cnf.write(if_then(column[layer-1], column[layer]))
                 # if none under you, then not you
-                cells3 = set((prefix,c3,prev_layer) for c3 in cells3)
-            cells3 &= volume
-            cells3 = [f(*c3) for c3 in cells3]
-            cnf.write([cells3 + [-f(prefix,c,layer)]])
-        cells = expand(adj, cells)
-    # misc linkages
-    columns = defaultdict(set)
-    for _,c,l in volume:
-        columns[c].add((prefix,c,l))
-    for c in columns:
-        cells = [f(prefix,c,l) for _,_,l in columns[c]]
+                under = [volume[j][layer-1] for j in nbrs[i] + [i] if 0 <= dist[j] < layer]
+            cnf.write([under + [-column[layer]]])
+        if wrap and d == 0:
+            last = [volume[j][size-1] for j in nbrs[i] if dist[j] != -1]
+            cnf.write([last + [-column[0]]])
+    # the last layer (or reach) is the whole region
+    summary_map = {}
+    for i,c in enumerate(cells):
+        summary_map[c] = (prefix,'summary',c)
+        if dist[i] == -1:
+            # dead columns
+            cnf.write_one(-f(prefix,'summary',c))
+            continue
         if exact:
-            # at most one per column
-            cnf.write(window(cells, 0, 1))
-        # if any in column, then summary
-        cnf.write(if_gen(cells, f(prefix,'summary',c), modeA=any, bidirectional=True))
-    # dead columns
-    flat_volume = set(c for _,c,_ in volume)
-    dead = base - flat_volume
-    for c in dead:
-        cnf.write_one(-f(prefix,'summary',c))
-    summary_map = dict((c,(prefix,'summary',c)) for c in base)
+            last = reach[i][size-1]
+        else:
+            last = volume[i][size-1]
+        cnf.write(if_gen(last, f(prefix,'summary',c), bidirectional=True))
+    cnf.auto_stack_pop()
+    return summary_map
+
+def _less_than(new, p, a, b, clauses):
+    "if p then a < b, big endian bit lists of the same length"
+    # one way only: 'equal above bit i' and 'first differs at bit i' terms
+    equal = None
+    firsts = []
+    for k,(ai,bi) in enumerate(zip(a, b)):
+        first = new()
+        clauses.append((-first, -ai))
+        clauses.append((-first, bi))
+        if equal is not None:
+            clauses.append((-first, equal))
+        firsts.append(first)
+        if k == len(a) - 1:
+            break
+        below = new()
+        clauses.append((-below, -ai, bi))
+        clauses.append((-below, ai, -bi))
+        if equal is not None:
+            clauses.append((-below, equal))
+        equal = below
+    clauses.append(tuple([-p] + firsts))
+
+def _at_most(a, k):
+    "a <= k, big endian bit list and an int"
+    ones = []
+    for i,ai in enumerate(a):
+        if (k >> (len(a) - 1 - i)) & 1:
+            ones.append(-ai)
+            continue
+        # matching every 1 above this bit, then this bit has to be 0
+        yield tuple(ones + [-ai])
+
+def connected(cnf, prefix, adj, size=None, exact=False, seed=None):
+    "cnf object, unique prefix, adjacent table, z size, exact size, seed label.  returns summary labels"
+    # drop-in for floodfill(), size is the number of layers or exact cells
+    # every cell in the region but the root points to a parent neighbor
+    # parents have a smaller binary distance, so every chain ends at the root
+    # O(edges * log cells) instead of floodfill's O(cells * size * degree)
+    # distances and parents are not unique, so they are hidden from solutions()
+    assert not(exact and size is None)
+    cells, index, nbrs = adjacency_arrays(adj)
+    if seed is None:
+        dist = array('i', [0]) * len(cells)
+    else:
+        dist = bfs_distances(nbrs, [index[seed]], limit=size)
+    live = [i for i in range(len(cells)) if dist[i] != -1]
+    longest = len(live) - 1
+    if size is not None:
+        longest = min(longest, size - 1)
+    bits = max(1, longest.bit_length())
+    f = cnf.auto_term
+    new = aux_maker(cnf, prefix, 'connected')
+    cnf.auto_stack_push(cnf.auto_mode)
+    method = ('unbounded', 'exact')[exact]
+    cnf.comment('%s %s connected region, size %s' % (prefix, method, size))
+    summary_map = dict((c,(prefix,'summary',c)) for c in cells)
+    summary = [f(*summary_map[c]) for c in cells]
+    scratch = cnf.maxterm + 1
+    for i in range(len(cells)):
+        if dist[i] == -1:
+            # dead cells
+            cnf.write_one(-summary[i])
+    distance = [None] * len(cells)
+    for i in live:
+        distance[i] = [f(prefix, 'distance', cells[i], b) for b in range(bits)]
+        # no deeper than the last layer
+        cnf.write(_at_most(distance[i], longest))
+    if seed is None:
+        roots = [f(prefix, 'root', cells[i]) for i in live]
+        cnf.write(window(roots, 1, 1, cnf=cnf))
+        for i,r in zip(live, roots):
+            cnf.write(if_then(r, summary[i]))
+            cnf.write(if_gen(r, neg(distance[i]), modeB=all))
+    else:
+        cnf.write_one(summary[index[seed]])
+        cnf.write([(-d,) for d in distance[index[seed]]])
+    clauses = []
+    for n,i in enumerate(live):
+        if seed is not None and dist[i] == 0:
+            continue
+        parents = []
+        for j in nbrs[i]:
+            if dist[j] == -1:
+                continue
+            # no point in a parent further from the seed than you
+            if seed is not None and dist[j] > longest - 1:
+                continue
+            p = f(prefix, 'parent', cells[i], cells[j])
+            parents.append(p)
+            clauses.append((-p, summary[j]))
+            _less_than(new, p, distance[j], distance[i], clauses)
+        # in the region and not the root, then some parent
+        if seed is None:
+            clauses.append(tuple([-summary[i], roots[n]] + parents))
+        else:
+            clauses.append(tuple([-summary[i]] + parents))
+        if len(clauses) > 10000:
+            cnf.write(clauses)
+            clauses = []
+    cnf.write(clauses)
+    if exact:
+        cnf.write(window([summary[i] for i in live], size, size, cnf=cnf))
+    cnf.hide_terms(range(scratch, cnf.maxterm + 1))
     cnf.auto_stack_pop()
     return summary_map
 
+def partition(cnf, prefix, adj, regions, apart=()):
+    "cnf object, unique prefix, adjacent table, {label: (seed, size)}, labels that can't touch.  returns {label: summary labels}"
+    # every cell is in exactly one region, a None seed or size is free
+    # the region labels are the summary prefixes, like floodfill()
+    # one parent pointer forest is shared by all regions, see connected()
+    # a region's map only has the cells within size of its seed
+    # distances, parents and roots are not unique, so they are hidden from solutions()
+    cells, index, nbrs = adjacency_arrays(adj)
+    f = cnf.auto_term
+    new = aux_maker(cnf, prefix, 'partition')
+    cnf.auto_stack_push(cnf.auto_mode)
+    cnf.comment('%s partition into %i regions' % (prefix, len(regions)))
+    summary_maps = {}
+    # member[i] is label: term for every region that can reach cell i
+    member = [{} for c in cells]
+    for label,(seed,size) in regions.items():
+        summary_maps[label] = {}
+        if seed is None:
+            dist = array('i', [0]) * len(cells)
+        else:
+            dist = bfs_distances(nbrs, [index[seed]], limit=size)
+        for i,c in enumerate(cells):
+            if dist[i] == -1:
+                continue
+            summary_maps[label][c] = (label,'summary',c)
+            member[i][label] = f(label,'summary',c)
+    scratch = cnf.maxterm + 1
+    bits = max(1, (len(cells) - 1).bit_length())
+    distance = [[f(prefix, 'distance', c, b) for b in range(bits)] for c in cells]
+    seeded = set(index[seed] for seed,size in regions.values() if seed is not None)
+    roots = [[] for c in cells]
+    for label,(seed,size) in regions.items():
+        if seed is not None:
+            i = index[seed]
+            cnf.write_one(member[i][label])
+            cnf.write([(-d,) for d in distance[i]])
+            continue
+        terms = []
+        for i in range(len(cells)):
+            if label not in member[i] or i in seeded:
+                continue
+            r = f(prefix, 'root', label, cells[i])
+            terms.append(r)
+            roots[i].append(r)
+            cnf.write(if_then(r, member[i][label]))
+            cnf.write(if_gen(r, neg(distance[i]), modeB=all))
+        cnf.write(window(terms, 1, 1, cnf=cnf))
+    cnf.comment('%s one region per cell' % prefix)
+    for i in range(len(cells)):
+        cnf.write(window(list(member[i].values()), 1, 1, cnf=cnf))
+    cnf.comment('%s parents' % prefix)
+    clauses = []
+    for i in range(len(cells)):
+        if i in seeded:
+            continue
+        parents = []
+        for j in nbrs[i]:
+            shared = [label for label in member[i] if label in member[j]]
+            if not shared:
+                continue
+            p = f(prefix, 'parent', cells[i], cells[j])
+            parents.append(p)
+            # the parent is in the same region
+            for label,m in member[i].items():
+                if label in member[j]:
+                    clauses.append((-p, -m, member[j][label]))
+                else:
+                    clauses.append((-p, -m))
+            _less_than(new, p, distance[j], distance[i], clauses)
+        # not a root, then some parent
+        clauses.append(tuple(roots[i] + parents))
+        if len(clauses) > 10000:
+            cnf.write(clauses)
+            clauses = []
+    cnf.write(clauses)
+    if apart:
+        cnf.comment("%s regions that can't touch" % prefix)
+        apart = set(apart)
+        fenced = [None] * len(cells)
+        for i in range(len(cells)):
+            ms = [m for label,m in member[i].items() if label in apart]
+            if not ms:
+                continue
+            fenced[i] = f(prefix, 'apart', cells[i])
+            cnf.write(if_gen(ms, fenced[i], modeA=any, bidirectional=True))
+        # next to another fenced cell, then the same region
+        for i in range(len(cells)):
+            for j in nbrs[i]:
+                if j < i or fenced[j] is None:
+                    continue
+                for label,m in member[i].items():
+                    if label not in apart:
+                        continue
+                    if label in member[j]:
+                        cnf.write_one(-m, -fenced[j], member[j][label])
+                    else:
+                        cnf.write_one(-m, -fenced[j])
+    for label,(seed,size) in regions.items():
+        if size is None:
+            continue
+        terms = [f(*summary_maps[label][c]) for c in summary_maps[label]]
+        cnf.write(window(terms, size, size, cnf=cnf))
+    cnf.hide_terms(range(scratch, cnf.maxterm + 1))
+    cnf.auto_stack_pop()
+    return summary_maps
+
 def segment(center, n, e, s, w):
     "binary points to unicode char"
     # full width character?  double line symbols?
@@ -912,4 +2328,103 @@ def tree_one(cnf, prefix, cells):
     cnf.auto_stack_pop()
     return cells[0]
 
+# linear at-most-one / exactly-one encodings
+# like window(0,1) and window(1,1), scratch terms are fully defined
+
+one_methods = ('commander', 'product', 'binary', 'bimander')
+
+def one_clauses(new, cells, method, exact=False, clauses=None):
+    "at most one (exactly one if exact) of cells, returns the clauses"
+    if clauses is None:
+        clauses = []
+    cells = list(cells)
+    if method == 'commander':
+        _commander_one(new, cells, clauses)
+    elif method == 'product':
+        _product_one(new, cells, clauses)
+    elif method == 'binary':
+        _binary_one(new, cells, 1, clauses)
+    elif method == 'bimander':
+        _binary_one(new, cells, 2, clauses)
+    else:
+        raise Exception('unknown method %s' % method)
+    if exact:
+        clauses.append(tuple(cells))
+    return clauses
+
+def _naive_one(cells, clauses):
+    for a,b in combinations(cells, 2):
+        clauses.append((-a, -b))
+
+def _any_term(new, cells, clauses):
+    "new term that is true iff any of cells is"
+    if len(cells) == 1:
+        return cells[0]
+    c = new()
+    for x in cells:
+        clauses.append((-x, c))
+    clauses.append(tuple([-c] + cells))
+    return c
+
+def _commander_one(new, cells, clauses, group=3):
+    "klieber and kwon, recurses on one commander per group"
+    if len(cells) <= 6:
+        return _naive_one(cells, clauses)
+    commanders = []
+    for i in range(0, len(cells), group):
+        cs = cells[i:i+group]
+        _naive_one(cs, clauses)
+        commanders.append(_any_term(new, cs, clauses))
+    _commander_one(new, commanders, clauses, group)
+
+def _product_one(new, cells, clauses):
+    "chen's 2-product, cells on a grid with one row and one column term"
+    if len(cells) <= 6:
+        return _naive_one(cells, clauses)
+    width = 1
+    while width * width < len(cells):
+        width += 1
+    rows = [cells[i:i+width] for i in range(0, len(cells), width)]
+    cols = [cells[i::width] for i in range(width)]
+    row_terms = [_any_term(new, r, clauses) for r in rows]
+    col_terms = [_any_term(new, c, clauses) for c in cols]
+    _product_one(new, row_terms, clauses)
+    _product_one(new, col_terms, clauses)
+
+def _binary_one(new, cells, group, clauses):
+    "frisch's binary encoding, or bimander with groups bigger than 1"
+    if len(cells) <= 6:
+        return _naive_one(cells, clauses)
+    groups = [cells[i:i+group] for i in range(0, len(cells), group)]
+    width = 1
+    while 2 ** width < len(groups):
+        width += 1
+    bits = [new() for i in range(width)]
+    for i,g in enumerate(groups):
+        _naive_one(g, clauses)
+        for x in g:
+            for j,b in enumerate(bits):
+                clauses.append((-x, (-b, b)[(i >> j) & 1]))
+    for j,b in enumerate(bits):
+        # only set when something in a matching group is
+        clauses.append(tuple([-b] + [x for i,g in enumerate(groups) if (i >> j) & 1 for x in g]))
+
+def commander_one(cnf, prefix, cells, exact=False):
+    "like window(0,1) or window(1,1) but O(n), groups of three"
+    for clause in one_clauses(aux_maker(cnf, prefix, 'commander'), cells, 'commander', exact):
+        yield clause
+
+def product_one(cnf, prefix, cells, exact=False):
+    "like window(0,1) or window(1,1), 2n + O(sqrt(n)) clauses"
+    for clause in one_clauses(aux_maker(cnf, prefix, 'product'), cells, 'product', exact):
+        yield clause
+
+def binary_one(cnf, prefix, cells, exact=False):
+    "like window(0,1) or window(1,1), only log(n) new terms"
+    for clause in one_clauses(aux_maker(cnf, prefix, 'binary'), cells, 'binary', exact):
+        yield clause
 
+def bimander_one(cnf, prefix, cells, exact=False):
+    "binary over pairs of cells, fewer clauses than binary_one"
+    for clause in one_clauses(aux_maker(cnf, prefix, 'bimander'), cells, 'bimander', exact):
+        yield clause
@@ -10,39 +10,20 @@
 # GPLv3
 
 """
-todo: pure terms
-    if only x or -x appears
-    then remove all x/-x from clauses
-    add single x/-x clause
-    align the 0 column
+todo: align the 0 column
 """
 
 
 import sys
 from itertools import *
+from collections import defaultdict, deque
+import dimacs
 
 def load_cnf(path):
     cnf = set()
-    for line in open(path):
-        line = line.strip()
-        if line.startswith('c'):
-            continue
-        if not line:
-            continue
-        # int-ify, remove dups and re-sort
-        line = set(int(i) for i in line.split() if i!='0')
-        line2 = []
-        for i in count(1):
-            if i in line:
-                line2.append(i)
-            if -i in line:
-                line2.append(-i)
-            line.discard(i)
-            line.discard(-i)
-            if not line:
-                break
-        # tuples for hashiness
-        cnf.add(tuple(line2))
+    for clause in dimacs.load(path):
+        # remove dups and re-sort, tuples for hashiness
+        cnf.add(tuple(sorted(set(clause), key=lambda i: (abs(i), i < 0))))
     return cnf
 
 def show(cnf):
@@ -70,91 +51,325 @@ def show(cnf):
 def size(cnf):
     return sum(map(len, cnf))
 
-def plusminus(cnf):
-    # finds (1 -1)
-    for c in cnf:
-        c_len = len(c)
-        c_set = set(map(abs, c))
-        if c_len != len(c_set):
-            return c
-    return None
-
-def one_difference(cnf):
-    # finds (1 2) (1 -2)
-    for c1 in cnf:
-        for i in range(len(c1)):
-            c2 = list(c1)
-            c2[i] *= -1
-            c2 = tuple(c2)
-            if c2 in cnf:
-                return c1, c2
-    return None, None
-
-def cancel_difference(c1, c2):
-    assert len(c1) == len(c2)
-    c3 = []
-    for t1,t2 in zip(c1, c2):
-        if t1 == t2:
-            c3.append(t1)
-    c3 = tuple(c3)
-    assert len(c3) + 1 == len(c1)
-    return c3
-
-def subset(cnf):
-    # finds (1 2 3) (1 2)
-    # very slow!
-    cnf2 = list(cnf)
-    for i in range(len(cnf2)):
-        c1 = cnf2[i]
-        s1 = set(c1)
-        for j in range(i+1, len(cnf2)):
-            c2 = cnf2[j]
-            s2 = set(c2)
-            if s1.issuperset(s2):
-                return c1, c2
-            if s2.issuperset(s1):
-                return c2, c1
-    return None, None
-
-def shorter(c1, c2):
-    assert len(c1) != len(c2)
-    if len(c1) < len(c2):
-        return c1
-    return c2
-
-def none_filter(fn, c1, c2):
-    if c1 is None:
-        return None
-    if c2 is None:
-        return None
-    return fn(c1, c2)
+def signature(clause):
+    "64 bit summary of the variables, for quick subset rejection"
+    sig = 0
+    for n in clause:
+        sig |= 1 << (abs(n) & 63)
+    return sig
+
+class Simplifier(object):
+    "occurrence lists plus a worklist of clauses that changed"
+    # every clause on the worklist is used to
+    #   remove clauses it subsumes: (1 2) kills (1 2 3)
+    #   strengthen clauses by self-subsumption: (1 2) turns (1 -2 3) into (1 3)
+    # the old 'one difference' merge is the special case (1 2) (1 -2) -> (1)
+    def __init__(self, cnf=()):
+        self.clauses = {}  # id: frozenset
+        self.sigs = {}
+        self.index = {}  # frozenset: id
+        self.occurs = defaultdict(set)
+        self.queue = deque()
+        self.serial = count()
+        self.unsat = False
+        self.units = deque()
+        self.stack = []  # (pivot, clause), replayed backwards by extend()
+        self.frozen = set()  # variables that must not be eliminated
+        self.touched = set()  # variables worth another elimination attempt
+        for clause in sorted(cnf, key=len):
+            self.add(clause)
+    def add(self, clause):
+        c = frozenset(clause)
+        if any(-n in c for n in c):
+            return None
+        if c in self.index:
+            return self.index[c]
+        if not c:
+            self.unsat = True
+        if len(c) == 1:
+            self.units.extend(c)
+        cid = next(self.serial)
+        self.clauses[cid] = c
+        self.sigs[cid] = signature(c)
+        self.index[c] = cid
+        for n in c:
+            self.occurs[n].add(cid)
+            self.touched.add(abs(n))
+        self.queue.append(cid)
+        return cid
+    def remove(self, cid):
+        c = self.clauses.pop(cid)
+        del self.sigs[cid]
+        del self.index[c]
+        for n in c:
+            self.occurs[n].discard(cid)
+            self.touched.add(abs(n))
+    def strengthen(self, cid, n):
+        "drop literal n from a clause"
+        c = self.clauses[cid]
+        self.remove(cid)
+        c = self._forward(c - set([n]))
+        if c is not None:
+            self.add(c)
+    def _forward(self, c):
+        "older clauses may subsume or strengthen a new one"
+        occurs = self.occurs
+        changed = True
+        while changed:
+            changed = False
+            sig = signature(c)
+            for did in chain.from_iterable(occurs[n] | occurs[-n] for n in c):
+                if self.sigs[did] & ~sig:
+                    continue
+                d = self.clauses[did]
+                if len(d) > len(c):
+                    continue
+                flipped = None
+                for m in d:
+                    if m in c:
+                        continue
+                    if flipped is None and -m in c:
+                        flipped = -m
+                        continue
+                    break
+                else:
+                    if flipped is None:
+                        return None
+                    c = c - set([flipped])
+                    changed = True
+                    break
+        return c
+    def _backward(self, cid):
+        c = self.clauses[cid]
+        if not c:
+            return
+        occurs = self.occurs
+        sig = self.sigs[cid]
+        best = min(c, key=lambda n: len(occurs[n]) + len(occurs[-n]))
+        for did in list(occurs[best] | occurs[-best]):
+            if did == cid or did not in self.clauses:
+                continue
+            if sig & ~self.sigs[did]:
+                continue
+            d = self.clauses[did]
+            if len(d) < len(c):
+                continue
+            flipped = None
+            for n in c:
+                if n in d:
+                    continue
+                if flipped is None and -n in d:
+                    flipped = -n
+                    continue
+                break
+            else:
+                if flipped is None:
+                    self.remove(did)
+                else:
+                    self.strengthen(did, flipped)
+                if cid not in self.clauses:
+                    # strengthened into a duplicate of c
+                    return
+    def run(self):
+        while self.queue and not self.unsat:
+            cid = self.queue.popleft()
+            if cid in self.clauses:
+                self._backward(cid)
+        return self
+    def propagate(self):
+        "unit clauses fix a variable everywhere"
+        changed = False
+        while self.units and not self.unsat:
+            n = self.units.popleft()
+            c = frozenset([n])
+            if c not in self.index:
+                continue
+            changed = True
+            self.remove(self.index[c])
+            self.stack.append((n, c))
+            for cid in list(self.occurs[n]):
+                self.remove(cid)
+            for cid in list(self.occurs[-n]):
+                if cid in self.clauses:
+                    self.strengthen(cid, -n)
+        return changed
+    def pure(self):
+        "literals that only appear in one polarity"
+        changed = False
+        todo = set(abs(n) for n in self.occurs if self.occurs[n])
+        while todo:
+            v = todo.pop()
+            if v in self.frozen:
+                continue
+            for n in (v, -v):
+                if not self.occurs[n] or self.occurs[-n]:
+                    continue
+                changed = True
+                for cid in list(self.occurs[n]):
+                    c = self.clauses[cid]
+                    self.stack.append((n, c))
+                    self.remove(cid)
+                    todo.update(abs(m) for m in c if abs(m) != v)
+        return changed
+    def resolvents(self, v, limit, longest=20):
+        "None if there would be more than limit of them, or a long one"
+        found = set()
+        for pid in self.occurs[v]:
+            p = self.clauses[pid] - set([v])
+            for nid in self.occurs[-v]:
+                q = self.clauses[nid] - set([-v])
+                if any(-n in q for n in p):
+                    continue
+                r = p | q
+                if len(r) > longest:
+                    return None
+                found.add(r)
+                if len(found) > limit:
+                    return None
+        return found
+    def eliminate(self, grow=0):
+        "bounded variable elimination, the formula may not grow"
+        changed = False
+        occurs = self.occurs
+        todo = self.touched - self.frozen
+        self.touched = set()
+        cost = lambda v: len(occurs[v]) * len(occurs[-v])
+        for v in sorted(todo, key=cost):
+            if self.unsat:
+                break
+            pos, neg = len(occurs[v]), len(occurs[-v])
+            if not pos or not neg:
+                continue
+            if pos > 10 and neg > 10:
+                continue
+            found = self.resolvents(v, pos + neg + grow)
+            if found is None:
+                continue
+            changed = True
+            for n in (v, -v):
+                for cid in list(occurs[n]):
+                    self.stack.append((n, self.clauses[cid]))
+                    self.remove(cid)
+            # only backward checked, forward is too slow for long resolvents
+            for r in sorted(found, key=len):
+                self.add(r)
+            self.run()
+            self.propagate()
+        return changed
+    def simplify(self, units=True, pure=True, eliminate=True):
+        "everything until nothing changes"
+        while not self.unsat:
+            self.run()
+            changed = False
+            if units:
+                changed |= self.propagate()
+            if pure:
+                changed |= self.pure()
+            if eliminate:
+                changed |= self.eliminate()
+            if not changed:
+                break
+        return self
+    def extend(self, model):
+        "turn a solution of the reduced cnf into one of the original"
+        return extend(model, self.stack)
+    def cnf(self):
+        if self.unsat:
+            return set([()])
+        return set(tuple(sorted(c, key=lambda i: (abs(i), i < 0))) for c in self.clauses.values())
+
+def extend(model, stack):
+    "model is a set of true terms, eliminated terms get fixed up"
+    model = set(model)
+    for pivot, clause in reversed(stack):
+        if any((abs(n) in model) == (n > 0) for n in clause):
+            continue
+        if pivot > 0:
+            model.add(pivot)
+        else:
+            model.discard(-pivot)
+    return model
+
+def save_stack(path, stack):
+    fh = open(path, 'w')
+    for pivot, clause in stack:
+        rest = [n for n in clause if n != pivot]
+        fh.write(' '.join(map(str, [pivot] + rest)) + ' 0\n')
+    fh.close()
+
+def load_stack(path):
+    stack = []
+    for line in open(path):
+        clause = [int(n) for n in line.split() if n != '0']
+        stack.append((clause[0], frozenset(clause)))
+    return stack
+
+def load_solution(path):
+    "last line of minisat/cdcl.py output"
+    solution = open(path).readlines()[-1].strip()
+    return set(n for n in map(int, solution.split()) if n > 0)
+
+def load_lut(path):
+    "term: auto_term label"
+    lut = {}
+    for line in open(path):
+        line = line.rstrip('\n')
+        if line.startswith('#'):
+            continue
+        if line.startswith('\\#'):
+            line = line[1:]
+        k,v = line.rsplit('\t', 1)
+        lut[int(v)] = k
+    return lut
+
+def write_dimacs(path, cnf, terms):
+    fh = open(path, 'w')
+    fh.write('p cnf %i %i\n' % (terms, len(cnf)))
+    for clause in sorted(cnf, key=lambda c: (len(c), c)):
+        fh.write(' '.join(map(str, clause)) + ' 0\n')
+    fh.close()
+
+def usage():
+    print('simplify.py - shrink a cnf')
+    print('use: simplify.py [-u] [-p] [-e] in.cnf [out.cnf]')
+    print('    -u unit propagation, -p pure terms, -e variable elimination')
+    print('    without out.cnf the result is printed in columns')
+    print('    with out.cnf the reconstruction stack goes in out.cnf.stack')
+    print('use: simplify.py -x out.cnf.stack solution [in.cnf.lut]')
+    print('    extends a solution of out.cnf back to in.cnf')
+    print('    and with a lut prints the auto_term labels')
+    sys.exit()
 
 def main():
-    path = sys.argv[1]
-    cnf = load_cnf(path)
+    flags = [a for a in sys.argv[1:] if a.startswith('-')]
+    paths = [a for a in sys.argv[1:] if not a.startswith('-')]
+    if '-x' in flags:
+        if len(paths) not in (2, 3):
+            usage()
+        model = extend(load_solution(paths[1]), load_stack(paths[0]))
+        if len(paths) == 2:
+            print(' '.join(map(str, sorted(model))))
+            return
+        lut = load_lut(paths[2])
+        for n in sorted(model):
+            if n in lut:
+                print(lut[n])
+        return
+    if len(paths) not in (1, 2) or set(flags) - set(['-u', '-p', '-e']):
+        usage()
+    cnf = load_cnf(paths[0])
+    terms = max([abs(n) for c in cnf for n in c] + [0])
     print('c before %i %i' % (len(cnf), size(cnf)))
-    while True:
-        c3 = None
-        # try to order these from fast to slow
-        if c3 is None:
-            c3 = plusminus(cnf)
-        if c3 is None:
-            c1,c2 = one_difference(cnf)
-            c3 = none_filter(cancel_difference, c1, c2)
-        if c3 is None:
-            c1,c2 = subset(cnf)
-            c3 = none_filter(shorter, c1, c2)
-        if c3 is None:
-            break
-        cnf.discard(c1)
-        cnf.discard(c2)
-        cnf.add(c3)
+    simp = Simplifier(cnf)
+    simp.simplify('-u' in flags, '-p' in flags, '-e' in flags)
+    cnf = simp.cnf()
     print('c after  %i %i' % (len(cnf), size(cnf)))
-    show(cnf)
+    if len(paths) == 1:
+        show(cnf)
+        return
+    # terms keep their numbers so the lut still applies
+    write_dimacs(paths[1], cnf, terms)
+    save_stack(paths[1] + '.stack', simp.stack)
 
 if __name__ == '__main__':
     main()
-
-
-
-
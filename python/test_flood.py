@@ -0,0 +1,26 @@
+from sat import *
+
+def region_count(fill, **kw_args):
+    cnf = CNF()
+    mapping = fill(cnf, 'x', cartesian_table(range(3), range(3)), **kw_args)
+    summaries = [cnf.auto_term(*label) for label in mapping.values()]
+    count = cnf.count_solutions(interesting=summaries)
+    cnf.close()
+    return count
+
+def test_connected_matches_floodfill():
+    for kw_args in [dict(size=3, exact=True), dict(size=4, seed=(0,0)), dict(size=9)]:
+        assert region_count(connected, **kw_args) == region_count(floodfill, **kw_args)
+
+def test_connected_scratch_is_hidden():
+    cnf = CNF()
+    mapping = connected(cnf, 'x', cartesian_table(range(3), range(3)), seed=(1,1))
+    assert cnf.count_solutions() == 161
+    cnf.close()
+
+def test_partition_scratch_is_hidden():
+    cnf = CNF()
+    regions = {'a': ((0,0), 3), 'b': (None, None)}
+    partition(cnf, 'p', cartesian_table(range(3), range(3)), regions)
+    assert cnf.count_solutions() == 5
+    cnf.close()
@@ -0,0 +1,18 @@
+from sat import *
+
+def zebra_count(domain, clues=()):
+    axes = {'people': ['a', 'b', 'c'],
+            'color': ['red', 'green', 'blue'],
+            'likes': ['yes', 'no']}
+    cnf = Zebra()
+    cnf.load_axes(axes, domain=domain)
+    for a,b in clues:
+        cnf.write_one(cnf.f(a, b))
+    count = cnf.count_solutions()
+    cnf.close()
+    return count
+
+def test_domain_model_counts():
+    for clues in [(), [('red', 'yes')], [('red', 'yes'), ('blue', 'yes')], [('a', 'no'), ('a', 'red')]]:
+        assert zebra_count(None, clues) == zebra_count('people', clues)
+    assert zebra_count('people') == 48